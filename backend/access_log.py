@@ -0,0 +1,122 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+# 访问日志，每行一个 JSON 对象。请求线程只负责入队，写文件和轮转都在后台线程里做；
+# 队列满时直接丢弃并计数，日志再慢也不会拖住请求
+ACCESS_LOG_PATH = os.environ.get('TEXTBOOK_ACCESS_LOG', 'access.log')
+MAX_BYTES = int(os.environ.get('TEXTBOOK_ACCESS_LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+ROTATE_INTERVAL = float(os.environ.get('TEXTBOOK_ACCESS_LOG_ROTATE_HOURS', '24')) * 3600
+BACKUP_COUNT = int(os.environ.get('TEXTBOOK_ACCESS_LOG_BACKUPS', '5'))
+MAX_BUFFERED = 10000
+FLUSH_INTERVAL = 0.5
+MAX_BATCH = 1000
+
+
+def timestamp():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class AccessLog(threading.Thread):
+    def __init__(self, path=ACCESS_LOG_PATH, max_bytes=MAX_BYTES, rotate_interval=ROTATE_INTERVAL,
+                 backup_count=BACKUP_COUNT, max_buffered=MAX_BUFFERED):
+        super().__init__(name='access-log', daemon=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self._queue = queue.Queue(maxsize=max_buffered)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self._reported_drops = 0
+        self._file = None
+        self._opened_at = 0.0
+
+    def log(self, entry):
+        # entry 是普通字典，序列化放到后台线程做
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def stop(self):
+        self._stopping.set()
+        self.join(timeout=5)
+
+    def run(self):
+        try:
+            while not (self._stopping.is_set() and self._queue.empty()):
+                try:
+                    batch = [self._queue.get(timeout=FLUSH_INTERVAL)]
+                except queue.Empty:
+                    batch = []
+                while batch and len(batch) < MAX_BATCH:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                with self._lock:
+                    dropped = self.dropped - self._reported_drops
+                    self._reported_drops = self.dropped
+                if dropped:
+                    batch.append({'ts': timestamp(), 'event': 'log_dropped', 'count': dropped})
+                if batch:
+                    self._write(batch)
+        finally:
+            if self._file is not None:
+                self._file.close()
+
+    def _write(self, batch):
+        lines = []
+        for entry in batch:
+            try:
+                lines.append(json.dumps(entry, ensure_ascii=False, default=str))
+            except (TypeError, ValueError):
+                continue
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        try:
+            self._rotate_if_needed(len(data))
+            self._file.write(data)
+            self._file.flush()
+        except OSError:
+            # 磁盘写不进去时这一批记为丢弃，下次重新打开文件再试
+            with self._lock:
+                self.dropped += len(lines)
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            return
+        self.written += len(lines)
+
+    def _rotate_if_needed(self, incoming):
+        if self._file is not None:
+            too_big = self.max_bytes and self._file.tell() + incoming > self.max_bytes and self._file.tell() > 0
+            too_old = self.rotate_interval and time.monotonic() - self._opened_at >= self.rotate_interval
+            if not (too_big or too_old):
+                return
+            self._file.close()
+            self._file = None
+            # access.log -> access.log.1 -> access.log.2 ...，超过 backup_count 的删掉
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f'{self.path}.{index}'
+                if os.path.exists(source):
+                    os.replace(source, f'{self.path}.{index + 1}')
+            if self.backup_count > 0:
+                os.replace(self.path, f'{self.path}.1')
+            else:
+                os.remove(self.path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'ab')
+        self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'written': self.written, 'dropped': self.dropped, 'buffered': self._queue.qsize()}
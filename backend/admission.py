@@ -0,0 +1,142 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 每个路由: (最大并发数, 最多排队数)。没有列出的路由不限并发，只受线程池大小约束
+ROUTE_LIMITS = {
+    '/api/login': (8, 32),
+    '/api/register': (4, 16),
+    '/api/publish': (8, 32),
+    '/api/publish/batch': (2, 8),
+    '/api/listings/search': (8, 32),
+    '/api/search_book_by_isbn': (8, 32),
+    '/api/generate_qr': (4, 16),
+    '/api/listings/export': (2, 0),
+}
+QUEUE_TIMEOUT = float(os.environ.get('TEXTBOOK_ADMISSION_QUEUE_TIMEOUT', '2'))
+# 按客户端限流默认关闭：校园 NAT 后面的同学共用一个地址，放在反向代理后面时所有请求都来自 127.0.0.1，
+# 按地址限流会让大家分一个桶。打开时登录用户按账号计，匿名请求按地址计，
+# 经过 TEXTBOOK_TRUSTED_PROXIES 里的代理时取 X-Forwarded-For 里的客户端地址
+CLIENT_RATE = float(os.environ.get('TEXTBOOK_CLIENT_RATE', '0'))
+CLIENT_BURST = float(os.environ.get('TEXTBOOK_CLIENT_BURST', '40'))
+MAX_TRACKED_CLIENTS = 10000
+TRUSTED_PROXIES = frozenset(address.strip() for address in os.environ.get('TEXTBOOK_TRUSTED_PROXIES', '').split(',')
+                            if address.strip())
+
+
+def client_address(peer, forwarded_for, trusted_proxies=TRUSTED_PROXIES):
+    # X-Forwarded-For 由每一跳代理往后追加，客户端能伪造的只有最前面的部分；
+    # 从右往左跳过受信任的代理，第一个不是代理的地址就是真正连过来的客户端
+    if peer not in trusted_proxies or not forwarded_for:
+        return peer
+    for address in reversed(forwarded_for.split(',')):
+        address = address.strip()
+        if address and address not in trusted_proxies:
+            return address
+    return peer
+
+
+class Rejected(Exception):
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RouteGate:
+    def __init__(self, max_concurrent, max_queue, queue_timeout=QUEUE_TIMEOUT):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    def enter(self):
+        if self._slots.acquire(blocking=False):
+            return
+        # 排队的人数有上限，排不上或等太久都直接拒绝，保证被接受的请求延迟有界
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise Rejected(503, 1, 'queue_full')
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            raise Rejected(503, 1, 'queue_timeout')
+
+    def leave(self):
+        self._slots.release()
+
+
+class TokenBuckets:
+    # 每个客户端一个令牌桶，rate 为每秒补充的令牌数，burst 为桶容量
+    def __init__(self, rate=CLIENT_RATE, burst=CLIENT_BURST, max_clients=MAX_TRACKED_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, client):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[client] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            self._buckets.move_to_end(client)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class Ticket:
+    def __init__(self, gate):
+        self._gate = gate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._gate is not None:
+            self._gate.leave()
+
+
+class AdmissionController:
+    def __init__(self, route_limits=ROUTE_LIMITS, rate=CLIENT_RATE, burst=CLIENT_BURST):
+        self.gates = {route: RouteGate(*limits) for route, limits in route_limits.items()}
+        self.buckets = TokenBuckets(rate, burst) if rate > 0 else None
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = {}
+
+    def admit(self, route, client):
+        try:
+            if self.buckets is not None:
+                wait = self.buckets.take(client)
+                if wait:
+                    raise Rejected(429, max(1, math.ceil(wait)), 'rate_limited')
+            gate = self.gates.get(route)
+            if gate is not None:
+                gate.enter()
+        except Rejected as e:
+            with self._lock:
+                self.rejected[e.reason] = self.rejected.get(e.reason, 0) + 1
+            raise
+        with self._lock:
+            self.admitted += 1
+        return Ticket(gate)
+
+    def stats(self):
+        with self._lock:
+            return {'admitted': self.admitted, 'rejected': dict(self.rejected)}
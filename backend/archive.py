@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+import time
+
+import db
+import queries
+
+# 售出的和挂了太久没卖掉的教材定期移到 listings_archive，listings 和它的索引只保留在售的热数据
+COMPACT_INTERVAL = float(os.environ.get('TEXTBOOK_COMPACT_INTERVAL', '300'))
+COMPACT_BATCH_SIZE = int(os.environ.get('TEXTBOOK_COMPACT_BATCH_SIZE', '200'))
+LISTING_TTL_DAYS = float(os.environ.get('TEXTBOOK_LISTING_TTL_DAYS', '180'))
+# 两批之间让出写锁，写队列里等着的发布和登录可以先提交
+BATCH_PAUSE = 0.02
+
+
+def _move_batch(conn, select_sql, params, batch_size):
+    # 挑 id、复制、删除在同一个 IMMEDIATE 事务里做，挑出来的行不会在中途被别人改掉；
+    # 每批只有几百行，写锁只占几毫秒
+    conn.execute('BEGIN IMMEDIATE')
+    with conn:
+        ids = [row[0] for row in conn.execute(select_sql, params + (batch_size,))]
+        if not ids:
+            return 0
+        payload = json.dumps(ids)
+        conn.execute(queries.ARCHIVE_LISTINGS, (payload,))
+        conn.execute(queries.DELETE_LISTINGS_BY_IDS, (payload,))
+    return len(ids)
+
+
+def compact(conn, ttl_days=LISTING_TTL_DAYS, batch_size=COMPACT_BATCH_SIZE, pause=BATCH_PAUSE):
+    # 返回本次归档的数量 {'sold': n, 'expired': n}
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - ttl_days * 86400))
+    moved = {}
+    for reason, sql, params in (('sold', queries.SOLD_LISTING_IDS, ()),
+                                ('expired', queries.EXPIRED_LISTING_IDS, (cutoff,))):
+        moved[reason] = 0
+        while True:
+            count = _move_batch(conn, sql, params, batch_size)
+            moved[reason] += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+    return moved
+
+
+class Compactor(threading.Thread):
+    def __init__(self, cache, interval=COMPACT_INTERVAL):
+        super().__init__(name='listing-compactor', daemon=True)
+        self.cache = cache
+        self.interval = interval
+        self._stopped = threading.Event()
+        self.archived = 0
+        self.runs = 0
+
+    def run(self):
+        # 启动时先归档一次，之后每隔 interval 秒一次
+        while True:
+            try:
+                moved = sum(compact(db.get_connection()).values())
+                self.runs += 1
+                if moved:
+                    self.archived += moved
+                    self.cache.invalidate()
+            except Exception as e:
+                print(f'归档教材失败: {e}')
+            if self._stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        return {'archived': self.archived, 'runs': self.runs}
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, timezone
+
+import db
+import queries
+
+SESSION_CACHE_SIZE = int(os.environ.get('TEXTBOOK_SESSION_CACHE_SIZE', '10000'))
+SESSION_CACHE_TTL = float(os.environ.get('TEXTBOOK_SESSION_CACHE_TTL', '300'))
+# 无效令牌也缓存一小段时间，防止同一个坏令牌反复打到数据库
+NEGATIVE_TTL = 30.0
+SWEEP_INTERVAL = float(os.environ.get('TEXTBOOK_SESSION_SWEEP_INTERVAL', '600'))
+SWEEP_BATCH_SIZE = 1000
+
+SESSION_LIFETIME = timedelta(days=7)
+
+Session = namedtuple('Session', ['user_id', 'username', 'expires_at'])
+
+
+def parse_timestamp(value):
+    # SQLite 的 datetime('now') 是不带时区的 UTC 文本
+    parsed = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+def new_expiry():
+    return (datetime.now(timezone.utc) + SESSION_LIFETIME).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def bearer_token(headers):
+    auth = headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    return auth[len('Bearer '):].strip() or None
+
+
+class SessionCache:
+    def __init__(self, max_entries=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # token -> (session 或 None, 缓存到期的 monotonic 时间)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, token, session, ttl):
+        self._entries[token] = (session, time.monotonic() + ttl)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, token):
+        if not token:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(token)
+            if cached is not None and cached[1] > now:
+                session = cached[0]
+                if session is None or session.expires_at > time.time():
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return session
+
+        row = db.get_connection().execute(queries.SESSION_BY_TOKEN, (token,)).fetchone()
+        session = Session(row[0], row[1], parse_timestamp(row[2])) if row else None
+        with self._lock:
+            self.misses += 1
+            if session is None:
+                self._store(token, None, NEGATIVE_TTL)
+            else:
+                self._store(token, session, min(self.ttl, session.expires_at - time.time()))
+        return session
+
+    def add(self, token, user_id, username, expires_at):
+        session = Session(user_id, username, parse_timestamp(expires_at))
+        with self._lock:
+            self._store(token, session, self.ttl)
+        return session
+
+    def revoke(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def prune(self):
+        now = time.monotonic()
+        wall = time.time()
+        with self._lock:
+            stale = [token for token, (session, until) in self._entries.items()
+                     if until <= now or (session is not None and session.expires_at <= wall)]
+            for token in stale:
+                del self._entries[token]
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def sweep_expired(conn, batch_size=SWEEP_BATCH_SIZE):
+    # 分批删除，每批一个短事务，不会长时间占着写锁
+    total = 0
+    while True:
+        with conn:
+            deleted = conn.execute(queries.DELETE_EXPIRED_SESSIONS, (batch_size,)).rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+class SessionSweeper(threading.Thread):
+    def __init__(self, cache, interval=SWEEP_INTERVAL):
+        super().__init__(name='session-sweeper', daemon=True)
+        self.cache = cache
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        # 启动时先清一次，之后每隔 interval 秒清理
+        while True:
+            try:
+                sweep_expired(db.get_connection())
+                self.cache.prune()
+            except Exception as e:
+                print(f'清理过期会话失败: {e}')
+            if self._stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,71 @@
+import argparse
+import json
+import random
+import time
+
+import compression
+
+TITLES = ['高等数学', '线性代数', '概率论与数理统计', '数据结构', '大学英语', '大学物理',
+          '电路分析基础', '计算机组成原理', '操作系统', '马克思主义基本原理概论']
+CONDITIONS = ['全新', '9成新', '8成新', '7成新']
+DESCRIPTIONS = ['课本保存良好，无涂画', '几乎全新，仅翻阅过几次', '有少量笔记，不影响阅读',
+                '附赠课后习题答案', '图书馆旁当面交易']
+
+
+def sample_page(size, seed=0):
+    # 结构和 /api/listings 的返回一致
+    rng = random.Random(seed)
+    page = []
+    for i in range(size):
+        page.append({
+            "id": i + 1,
+            "textbook": {
+                "title": f'{rng.choice(TITLES)}（第{rng.randint(1, 9)}版）',
+                "author": rng.choice(['同济大学数学系', '严蔚敏', '张三', '未知作者']),
+                "isbn": f'978711{rng.randint(1000000, 9999999)}'
+            },
+            "seller": f'同学{rng.randint(1, 5000)}',
+            "price": round(rng.uniform(5, 80), 1),
+            "condition": rng.choice(CONDITIONS),
+            "description": rng.choice(DESCRIPTIONS),
+            "created_at": f'2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)} 10:{rng.randint(10, 59)}:00'
+        })
+    return json.dumps(page, ensure_ascii=False).encode('utf-8')
+
+
+def measure(body, level, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        compressed = compression.compress(body, level)
+    cpu = (time.process_time() - start) / rounds
+    return {
+        'level': level,
+        'raw_bytes': len(body),
+        'gzip_bytes': len(compressed),
+        'bytes_saved': len(body) - len(compressed),
+        'ratio': round(len(compressed) / len(body), 4),
+        'cpu_ms': round(cpu * 1000, 3),
+        # 每毫秒 CPU 换来多少字节的节省，用来选压缩级别
+        'bytes_saved_per_cpu_ms': round((len(body) - len(compressed)) / (cpu * 1000), 1) if cpu else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON 响应 gzip 压缩的 CPU 开销与节省字节对比')
+    parser.add_argument('--sizes', default='10,50,200', help='每页条数，逗号分隔')
+    parser.add_argument('--levels', default='1,6,9', help='gzip 压缩级别，逗号分隔')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        body = sample_page(size)
+        for level in (int(l) for l in args.levels.split(',')):
+            result = measure(body, level, args.rounds)
+            result['page_size'] = size
+            results.append(result)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import db
+import listings
+import migrations
+import passwords
+import queries
+
+# 用法:
+#   python bench_load.py --concurrency 32 --duration 20 --output baseline.json
+#   python bench_load.py --rate 500 --duration 20 --baseline baseline.json
+#   python bench_load.py --server minimal_app.py --mix listings=70,courses=30
+#   python bench_load.py --url http://localhost:5000   # 压已经在跑的服务，不启动也不造数据
+# 默认在临时目录里建一个新数据库、造好数据，再启动 simple_server.py 去压；
+# 延迟从请求“应该发出”的时刻算起，固定到达率模式下服务端排队的时间也会算进去。
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = 'listings=40,courses=20,isbn=20,publish=10,login=10'
+BENCH_PASSWORD = 'bench-password'
+ISBNS = ['9787111234562', '9787302123453', '9787508123455', '9787040123456',
+         # 不在数据源里的合法 ISBN，走未命中缓存
+         '9780306406157', '9787115428028']
+TITLES = ['高等数学', '线性代数', '概率论与数理统计', '数据结构', '大学英语', '大学物理',
+          '电路分析基础', '计算机组成原理', '操作系统', '马克思主义基本原理概论']
+PERCENTILES = (50, 95, 99)
+
+
+def seed_database(path, users, listing_count, seed=0):
+    rng = random.Random(seed)
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    # 压测账号共用一个密码哈希，造数据时只算一次 scrypt
+    password_hash = passwords.compute_hash(BENCH_PASSWORD)
+    with conn:
+        conn.executemany(queries.INSERT_USER, [
+            (f'bench{i}', f'bench{i}@example.com', password_hash, '计算机科学', '大二', '', '')
+            for i in range(users)
+        ])
+        params = []
+        for i in range(listing_count):
+            listing = listings.validate_listing({
+                'title': f'{rng.choice(TITLES)}（第{rng.randint(1, 9)}版）',
+                'isbn': rng.choice(ISBNS),
+                'price': round(rng.uniform(5, 80), 1),
+                'contact_info': f'wx{i}',
+            })
+            user = rng.randrange(users)
+            params.append(listings.insert_params(listing, user + 1, f'bench{user}'))
+        listings.insert_many(conn, params)
+    conn.close()
+
+
+class Connection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        for name, value in (headers or {}).items():
+            lines.append(f'{name}: {value}')
+        if body is not None:
+            lines.append('Content-Type: application/json')
+            lines.append(f'Content-Length: {len(body)}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + (body or b''))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('服务器关闭了连接')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if 'content-length' in response_headers:
+            payload = await self.reader.readexactly(int(response_headers['content-length']))
+            keep_alive = response_headers.get('connection', '').lower() != 'close'
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            payload = await self._read_chunked()
+            keep_alive = response_headers.get('connection', '').lower() != 'close'
+        else:
+            # HTTP/1.0 风格的服务（minimal_app、test_server）不带长度，读到连接关闭为止
+            payload = await self.reader.read()
+            keep_alive = False
+        if not keep_alive or status_line.startswith(b'HTTP/1.0'):
+            self.close()
+        return status, payload
+
+    async def _read_chunked(self):
+        parts = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await self.reader.readline()
+                return b''.join(parts)
+            parts.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Workload:
+    def __init__(self, mix, tokens, users, seed=0):
+        self.rng = random.Random(seed)
+        self.tokens = tokens
+        self.users = users
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.published = 0
+
+    def next_request(self):
+        # 返回 (接口名, 方法, 路径, 请求体, 请求头)
+        name = self.rng.choices(self.names, self.weights)[0]
+        if name == 'listings':
+            limit = self.rng.choice([20, 50])
+            return name, 'GET', f'/api/listings?limit={limit}', None, None
+        if name == 'courses':
+            return name, 'GET', '/api/courses/tree', None, None
+        if name == 'isbn':
+            return name, 'POST', '/api/search_book_by_isbn', _json({'isbn': self.rng.choice(ISBNS)}), None
+        if name == 'login':
+            user = self.rng.randrange(max(1, self.users))
+            return name, 'POST', '/api/login', _json({'username': f'bench{user}', 'password': BENCH_PASSWORD}), None
+        if name == 'publish':
+            self.published += 1
+            headers = {'Authorization': 'Bearer ' + self.rng.choice(self.tokens)} if self.tokens else None
+            body = _json({'title': f'{self.rng.choice(TITLES)}（压测 {self.published}）',
+                          'isbn': self.rng.choice(ISBNS), 'price': 20, 'contact_info': 'bench'})
+            return name, 'POST', '/api/publish', body, headers
+        raise ValueError(f'未知接口: {name}')
+
+
+def _json(data):
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, name, status, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+        key = str(status)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        # 查不到的 ISBN 回 404 属于正常结果；连接失败、限流和 5xx 才算错误
+        if status is None or status == 429 or status >= 500:
+            self.errors += 1
+
+
+async def timed_request(conn, recorder, request, scheduled):
+    name, method, path, body, headers = request
+    try:
+        status, _ = await conn.request(method, path, body, headers)
+    except (OSError, ValueError, asyncio.IncompleteReadError, ConnectionError):
+        conn.close()
+        status = None
+    recorder.record(name, status, time.perf_counter() - scheduled)
+
+
+async def closed_loop(host, port, workload, recorder, concurrency, deadline):
+    async def worker():
+        conn = Connection(host, port)
+        while time.perf_counter() < deadline:
+            await timed_request(conn, recorder, workload.next_request(), time.perf_counter())
+        conn.close()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def open_loop(host, port, workload, recorder, rate, deadline, max_outstanding):
+    # 按固定间隔发请求，不等前一个返回；空闲连接放回池子里复用
+    idle = []
+    outstanding = set()
+    interval = 1.0 / rate
+    next_at = time.perf_counter()
+
+    async def send(request, scheduled):
+        conn = idle.pop() if idle else Connection(host, port)
+        await timed_request(conn, recorder, request, scheduled)
+        idle.append(conn)
+
+    while next_at < deadline:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(outstanding) >= max_outstanding:
+            # 客户端自己也忙不过来，记一次失败而不是悄悄少发
+            recorder.record('dropped', None, 0.0)
+        else:
+            task = asyncio.ensure_future(send(workload.next_request(), next_at))
+            outstanding.add(task)
+            task.add_done_callback(outstanding.discard)
+        next_at += interval
+    if outstanding:
+        await asyncio.gather(*outstanding)
+    for conn in idle:
+        conn.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # 最近秩法：第 ceil(p% * n) 小的值
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(values, elapsed):
+    values = sorted(values)
+    summary = {'requests': len(values), 'throughput_rps': round(len(values) / elapsed, 1)}
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        summary[f'p{pct}_ms'] = round(value * 1000, 3) if value is not None else None
+    summary['max_ms'] = round(values[-1] * 1000, 3) if values else None
+    return summary
+
+
+def build_report(args, recorder, elapsed):
+    everything = [value for name, values in recorder.samples.items() if name != 'dropped' for value in values]
+    report = {
+        'config': {'server': args.url or args.server, 'mix': args.mix, 'duration': args.duration,
+                   'concurrency': None if args.rate else args.concurrency, 'rate': args.rate,
+                   'listings': args.listings, 'users': args.users},
+        'elapsed_s': round(elapsed, 3),
+        'overall': summarize(everything, elapsed),
+        'endpoints': {name: summarize(values, elapsed)
+                      for name, values in sorted(recorder.samples.items()) if name != 'dropped'},
+        'status_counts': recorder.statuses,
+        'errors': recorder.errors,
+    }
+    report['overall']['error_rate'] = round(recorder.errors / max(1, sum(recorder.statuses.values())), 4)
+    return report
+
+
+def compare(report, baseline, tolerance):
+    # 延迟变大或吞吐下降超过 tolerance（比例）就算退化
+    regressions = []
+    # 固定到达率模式下吞吐由 --rate 决定，只有两次都是固定并发时比较吞吐才有意义
+    check_throughput = not report['config'].get('rate') and not baseline.get('config', {}).get('rate')
+    sections = [('overall', report['overall'], baseline.get('overall', {}))]
+    for name, summary in report['endpoints'].items():
+        if name in baseline.get('endpoints', {}):
+            sections.append((name, summary, baseline['endpoints'][name]))
+    for name, current, previous in sections:
+        for key in [f'p{pct}_ms' for pct in PERCENTILES]:
+            if current.get(key) and previous.get(key) and current[key] > previous[key] * (1 + tolerance):
+                regressions.append({'endpoint': name, 'metric': key,
+                                    'baseline': previous[key], 'current': current[key]})
+        if (check_throughput and current.get('throughput_rps') and previous.get('throughput_rps')
+                and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance)):
+            regressions.append({'endpoint': name, 'metric': 'throughput_rps',
+                                'baseline': previous['throughput_rps'], 'current': current['throughput_rps']})
+    current_errors = report['overall'].get('error_rate', 0)
+    if current_errors > baseline.get('overall', {}).get('error_rate', 0) + 0.01:
+        regressions.append({'endpoint': 'overall', 'metric': 'error_rate',
+                            'baseline': baseline['overall'].get('error_rate', 0), 'current': current_errors})
+    return regressions
+
+
+def wait_for_port(host, port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'服务器启动失败，退出码 {process.returncode}')
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('等待服务器启动超时')
+
+
+def start_server(args, workdir):
+    env = dict(os.environ)
+    env['TEXTBOOK_DB'] = os.path.join(workdir, 'textbook_exchange.db')
+    # 压测从同一个地址发出，关掉按客户端限流，否则测的只是令牌桶
+    env.setdefault('TEXTBOOK_CLIENT_RATE', '0')
+    env['PYTHONUNBUFFERED'] = '1'
+    for item in args.env:
+        name, _, value = item.partition('=')
+        env[name] = value
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, args.server)], cwd=workdir, env=env,
+                               stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    return process, log
+
+
+def stop_server(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def login_tokens(host, port, users, count):
+    tokens = []
+    conn = Connection(host, port)
+    for i in range(min(users, count)):
+        status, payload = await conn.request('POST', '/api/login',
+                                             _json({'username': f'bench{i}', 'password': BENCH_PASSWORD}))
+        if status == 200:
+            token = json.loads(payload).get('token')
+            if token:
+                tokens.append(token)
+    conn.close()
+    return tokens
+
+
+async def run(args, host, port):
+    mix = parse_mix(args.mix)
+    tokens = await login_tokens(host, port, args.users, 8) if any(n == 'publish' for n, _ in mix) else []
+    workload = Workload(mix, tokens, args.users, args.seed)
+    recorder = Recorder()
+    if args.warmup:
+        warm_deadline = time.perf_counter() + args.warmup
+        await closed_loop(host, port, workload, Recorder(), min(args.concurrency, 8), warm_deadline)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    if args.rate:
+        await open_loop(host, port, workload, recorder, args.rate, deadline, args.max_outstanding)
+    else:
+        await closed_loop(host, port, workload, recorder, args.concurrency, deadline)
+    return build_report(args, recorder, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='后端压测：固定并发或固定到达率，输出吞吐和分位延迟')
+    parser.add_argument('--server', default='simple_server.py', help='backend 目录下要启动的服务脚本')
+    parser.add_argument('--url', help='直接压已经在运行的服务，不启动服务也不造数据')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='接口=权重，逗号分隔')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, help='每秒请求数；指定后改为固定到达率模式')
+    parser.add_argument('--max-outstanding', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--listings', type=int, default=5000, help='造数据时的在售教材数量')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env', action='append', default=[], help='传给服务进程的环境变量 NAME=VALUE')
+    parser.add_argument('--output', help='把结果另存为 JSON 文件，可以作为以后的基线')
+    parser.add_argument('--baseline', help='和之前保存的结果对比，退化时退出码为 1')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    parser.add_argument('--keep-workdir', action='store_true', help='保留临时目录里的数据库和服务日志')
+    args = parser.parse_args()
+
+    process = log = None
+    workdir = None
+    if args.url:
+        parsed = urllib.parse.urlsplit(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = '127.0.0.1', 5000
+        workdir = tempfile.mkdtemp(prefix='textbook-bench-')
+        if args.server == 'simple_server.py':
+            seed_database(os.path.join(workdir, 'textbook_exchange.db'), args.users, args.listings, args.seed)
+        process, log = start_server(args, workdir)
+    try:
+        if process is not None:
+            wait_for_port(host, port, process)
+        report = asyncio.run(run(args, host, port))
+    finally:
+        if process is not None:
+            stop_server(process)
+            log.close()
+
+    if workdir and args.keep_workdir:
+        report['workdir'] = workdir
+    elif workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        report['regressions'] = regressions
+        differing = sorted(key for key, value in report['config'].items()
+                           if baseline.get('config', {}).get(key) != value)
+        if differing:
+            report['config_differs_from_baseline'] = differing
+        exit_code = 1 if regressions else 0
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
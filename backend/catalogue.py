@@ -0,0 +1,45 @@
+import json
+import threading
+
+import compression
+import queries
+from response_cache import CachedResponse, make_etag
+
+
+def encode_payload(data):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    # 课程树很少变化，用最高压缩级别换取更小的传输量
+    return CachedResponse(body, make_etag(body), {}, compression.maybe_compress(body, 9))
+
+
+class CatalogueSnapshot:
+    def __init__(self, version, tree):
+        self.version = version
+        self.tree = tree
+        self.full = encode_payload(tree)
+        self.majors = {name: encode_payload({name: semesters}) for name, semesters in tree.items()}
+
+
+class CourseCatalogue:
+    # 课程树只在 catalogue_meta.version 变化时重建，平时直接返回编码好的字节
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def snapshot(self, conn):
+        version = conn.execute(queries.CATALOGUE_VERSION).fetchone()[0]
+        current = self._snapshot
+        if current is not None and current.version == version:
+            return current
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = CatalogueSnapshot(version, load_tree(conn))
+            return self._snapshot
+
+
+def load_tree(conn):
+    tree = {}
+    for major, semester, course_id, name, code in conn.execute(queries.CATALOGUE_TREE):
+        courses = tree.setdefault(major, {}).setdefault(semester, [])
+        courses.append({"id": course_id, "name": name, "code": code})
+    return tree
@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+import urllib.parse
+
+import bench_load
+import db
+import import_listings
+import migrations
+
+# 用法:
+#   python check_batch.py
+#   python check_batch.py --url http://localhost:5000
+# 批量发布和导入脚本里混入价格非法的行（字符串 nan/inf、JSON 的 NaN、溢出成 inf 的数字），
+# 检查这些行逐条报错、其余行照常写入，之后的列表接口输出的仍是合法 JSON。
+# 默认在临时目录里造数据并启动 simple_server.py；结果不对时退出码为 1。
+
+RECORDS = [
+    {'title': '高等数学（第7版）', 'price': 25, 'contact_info': 'wx-valid-1'},
+    {'title': '线性代数', 'price': 'nan', 'contact_info': 'wx-nan'},
+    {'title': '大学物理', 'price': 'inf', 'contact_info': 'wx-inf'},
+    {'title': '概率论与数理统计', 'price': float('nan'), 'contact_info': 'wx-json-nan'},
+    {'title': '离散数学', 'price': 1e400, 'contact_info': 'wx-overflow'},
+    {'title': '数据结构', 'price': '-inf', 'contact_info': 'wx-negative-inf'},
+    {'title': '大学英语', 'price': '18.5', 'contact_info': 'wx-valid-2'},
+]
+VALID = [0, 6]
+
+
+def _strict_json(payload):
+    # 标准 JSON 没有 NaN / Infinity，json.loads 默认却接受，这里按不合法处理
+    def reject(constant):
+        raise ValueError(f'不合法的 JSON 常量 {constant}')
+    return json.loads(payload, parse_constant=reject)
+
+
+def check_import():
+    problems = []
+    workdir = tempfile.mkdtemp(prefix='textbook-batch-import-')
+    try:
+        conn = db.connect(os.path.join(workdir, 'textbook_exchange.db'))
+        migrations.migrate(conn)
+        records = [(index + 1, record) for index, record in enumerate(RECORDS)]
+        try:
+            inserted, errors = import_listings.run_import(conn, records, 1, '导入检查', 2)
+        except Exception as e:
+            conn.close()
+            return {'error': repr(e)}, [f'导入脚本遇到非法价格时中断: {e!r}']
+        conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    rejected = sorted(line_no - 1 for line_no, _ in errors)
+    if inserted != len(VALID) or rejected != [i for i in range(len(RECORDS)) if i not in VALID]:
+        problems.append(f'导入应写入 {len(VALID)} 行、其余逐行报错: inserted={inserted} rejected={rejected}')
+    return {'inserted': inserted, 'rejected': rejected}, problems
+
+
+async def check_publish(host, port):
+    problems = []
+    tokens = await bench_load.login_tokens(host, port, 1, 1)
+    if not tokens:
+        raise RuntimeError('登录失败')
+    conn = bench_load.Connection(host, port)
+    try:
+        try:
+            status, payload = await conn.request('POST', '/api/publish/batch', bench_load._json(RECORDS),
+                                                 {'Authorization': f'Bearer {tokens[0]}'})
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            return {'error': repr(e)}, [f'批量发布时服务器断开了连接: {e!r}']
+        result = json.loads(payload)
+        rejected = sorted(error['index'] for error in result.get('errors', []))
+        if status != 200 or result.get('inserted') != len(VALID) \
+                or rejected != [i for i in range(len(RECORDS)) if i not in VALID]:
+            problems.append(f'批量发布应写入 {len(VALID)} 行、其余逐行报错: {status} {result}')
+
+        status, payload = await conn.request('GET', '/api/listings?sort=price_desc&limit=100')
+        try:
+            _strict_json(payload)
+        except ValueError as e:
+            problems.append(f'列表接口输出的不是合法 JSON: {e}')
+    finally:
+        conn.close()
+    return {'status': status, 'inserted': result.get('inserted'), 'rejected': rejected}, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量发布和导入时混入非法价格，检查逐行报错且不影响其余行')
+    parser.add_argument('--url', help='检查已经在运行的服务（需要 bench_load.py 造的账号）')
+    parser.add_argument('--keep-workdir', action='store_true')
+    args = parser.parse_args()
+
+    report = {}
+    report['import'], problems = check_import()
+
+    process = log = None
+    workdir = None
+    if args.url:
+        parsed = urllib.parse.urlsplit(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = '127.0.0.1', 5000
+        workdir = tempfile.mkdtemp(prefix='textbook-batch-')
+        bench_load.seed_database(os.path.join(workdir, 'textbook_exchange.db'), 1, 10)
+        server_args = types.SimpleNamespace(server='simple_server.py', env=[])
+        process, log = bench_load.start_server(server_args, workdir)
+    try:
+        if process is not None:
+            bench_load.wait_for_port(host, port, process)
+        report['publish'], publish_problems = asyncio.run(check_publish(host, port))
+        problems += publish_problems
+    finally:
+        if process is not None:
+            bench_load.stop_server(process)
+            log.close()
+
+    if workdir and args.keep_workdir:
+        report['workdir'] = workdir
+    elif workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report['problems'] = problems
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+import urllib.parse
+
+import bench_load
+
+# 用法:
+#   python check_contention.py --clients 64
+#   python check_contention.py --url http://localhost:5000 --clients 32 --listing 12
+# 很多买家同时预订同一本教材、卖家同时提交多次修改，检查条件更新的结果：
+# 预订只有一个买家成功，修改只有一个请求成功，其余都应该收到 409，最终 version 和成功次数对得上。
+# 默认在临时目录里造数据并启动 simple_server.py；结果不对时退出码为 1。
+
+
+async def login(host, port, users):
+    tokens = await bench_load.login_tokens(host, port, users, users)
+    if len(tokens) < users:
+        raise RuntimeError(f'只登录成功 {len(tokens)} 个账号')
+    return tokens
+
+
+async def listing_state(host, port, listing_id):
+    conn = bench_load.Connection(host, port)
+    try:
+        status, payload = await conn.request('GET', f'/api/listings/{listing_id}')
+    finally:
+        conn.close()
+    if status != 200:
+        raise RuntimeError(f'读取教材 {listing_id} 失败: {status}')
+    return json.loads(payload)
+
+
+async def hammer(host, port, path, bodies, tokens):
+    # 每个客户端一条连接，全部就绪后同时发出，尽量让请求挤在同一个提交窗口里
+    start = asyncio.Event()
+
+    async def client(body, token):
+        conn = bench_load.Connection(host, port)
+        try:
+            await start.wait()
+            status, payload = await conn.request('POST', path, bench_load._json(body),
+                                                 {'Authorization': f'Bearer {token}'})
+            return status, json.loads(payload)
+        finally:
+            conn.close()
+
+    tasks = [asyncio.create_task(client(body, token)) for body, token in zip(bodies, tokens)]
+    await asyncio.sleep(0.1)
+    start.set()
+    return await asyncio.gather(*tasks)
+
+
+def tally(results):
+    counts = {}
+    for status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+async def run(args, host, port):
+    listing = await listing_state(host, port, args.listing)
+    seller = listing['seller_id']
+    # bench_load 造的账号 benchN 的 id 是 N + 1；卖家自己排除在买家之外
+    tokens = await login(host, port, args.users)
+    seller_token = tokens[seller - 1]
+    buyers = [token for index, token in enumerate(tokens) if index != seller - 1]
+    buyers = (buyers * (args.clients // len(buyers) + 1))[:args.clients]
+    problems = []
+
+    version = listing['version']
+    results = await hammer(host, port, f'/api/listings/{args.listing}/reserve',
+                           [{'version': version}] * len(buyers), buyers)
+    reserve = tally(results)
+    if reserve.get(200) != 1 or reserve.get(409, 0) != len(buyers) - 1:
+        problems.append(f'预订应该只有一个成功: {reserve}')
+
+    state = await listing_state(host, port, args.listing)
+    version = state['version']
+    if state['status'] != 'reserved' or version != listing['version'] + 1:
+        problems.append(f'预订后的状态不对: {state["status"]} version={version}')
+
+    results = await hammer(host, port, f'/api/listings/{args.listing}/update',
+                           [{'version': version, 'price': 10 + i} for i in range(args.clients)],
+                           [seller_token] * args.clients)
+    update = tally(results)
+    winners = [body for status, body in results if status == 200]
+    if update.get(200) != 1 or update.get(409, 0) != args.clients - 1:
+        problems.append(f'同一个 version 的修改应该只有一个成功: {update}')
+
+    final = await listing_state(host, port, args.listing)
+    if final['version'] != version + len(winners):
+        problems.append(f'最终 version={final["version"]}，应为 {version + len(winners)}')
+
+    return {'listing': args.listing, 'clients': args.clients, 'reserve': reserve, 'update': update,
+            'final': {'version': final['version'], 'status': final['status'], 'price': final['price']},
+            'problems': problems}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发预订和修改同一本教材，检查条件更新只产生一个赢家')
+    parser.add_argument('--url', help='检查已经在运行的服务（需要 bench_load.py 造的账号）')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--users', type=int, default=16, help='登录的账号数，买家轮流使用')
+    parser.add_argument('--listing', type=int, default=1, help='被争抢的教材 id')
+    parser.add_argument('--keep-workdir', action='store_true')
+    args = parser.parse_args()
+
+    process = log = None
+    workdir = None
+    if args.url:
+        parsed = urllib.parse.urlsplit(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = '127.0.0.1', 5000
+        workdir = tempfile.mkdtemp(prefix='textbook-contention-')
+        bench_load.seed_database(os.path.join(workdir, 'textbook_exchange.db'), args.users, 100)
+        server_args = types.SimpleNamespace(server='simple_server.py', env=[])
+        process, log = bench_load.start_server(server_args, workdir)
+    try:
+        if process is not None:
+            bench_load.wait_for_port(host, port, process)
+        report = asyncio.run(run(args, host, port))
+    finally:
+        if process is not None:
+            bench_load.stop_server(process)
+            log.close()
+
+    if workdir and args.keep_workdir:
+        report['workdir'] = workdir
+    elif workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(1 if report['problems'] else 0)
+
+
+if __name__ == '__main__':
+    main()
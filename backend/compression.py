@@ -0,0 +1,39 @@
+import gzip
+import os
+
+GZIP_LEVEL = int(os.environ.get('TEXTBOOK_GZIP_LEVEL', '6'))
+# 小于这个字节数的响应压缩收益不抵 gzip 头和 CPU 开销
+GZIP_MIN_SIZE = int(os.environ.get('TEXTBOOK_GZIP_MIN_SIZE', '1024'))
+
+
+def accepts_gzip(accept_encoding):
+    # 只做最简单的协商：看 gzip 的 q 值，没有单独列出 gzip 时才看 *；
+    # 明确写了 gzip;q=0 的客户端，即使还写了 * 也不压缩
+    weights = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if coding not in ('gzip', '*'):
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    return weights.get('gzip', weights.get('*', 0.0)) > 0
+
+
+def compress(body, level=None):
+    # mtime=0 让相同内容得到相同的压缩结果
+    return gzip.compress(body, GZIP_LEVEL if level is None else level, mtime=0)
+
+
+def maybe_compress(body, level=None):
+    if len(body) < GZIP_MIN_SIZE:
+        return None
+    compressed = compress(body, level)
+    return compressed if len(compressed) < len(body) else None
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+import search
+
+DB_PATH = os.environ.get('TEXTBOOK_DB', 'textbook_exchange.db')
+
+# 连接建立时执行一次，之后整个 worker 生命周期复用
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA cache_size = -65536',
+)
+BUSY_TIMEOUT = 5.0
+STATEMENT_CACHE_SIZE = 256
+
+class TimedCursor(sqlite3.Cursor):
+    # 给 /metrics 统计 SQL 执行和取结果的耗时
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_query(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_query(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.observe_query(time.perf_counter() - start, 0)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            metrics.observe_query(time.perf_counter() - start, 0)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.observe_query(time.perf_counter() - start, 0)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute 是 C 实现的快捷方式，不会走 cursor()，所以这两个方法也要覆盖
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+_local = threading.local()
+_all_connections = []
+_all_lock = threading.Lock()
+
+
+def connect(path=None):
+    # check_same_thread=False 只是为了让 close_all 能在主线程关闭连接，
+    # 连接本身仍然只由创建它的线程使用
+    start = time.perf_counter()
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False, factory=TimedConnection)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    search.register_functions(conn)
+    metrics.observe_connect(time.perf_counter() - start)
+    return conn
+
+
+def get_connection():
+    # 每个线程一条长连接，线程池中的 worker 会一直复用它
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+        with _all_lock:
+            _all_connections.append(conn)
+    return conn
+
+
+def close_all():
+    with _all_lock:
+        connections = list(_all_connections)
+        _all_connections.clear()
+    for conn in connections:
+        conn.close()
+    _local.__dict__.pop('conn', None)
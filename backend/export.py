@@ -0,0 +1,51 @@
+import json
+
+import queries
+
+EXPORT_BATCH_SIZE = 500
+
+# archived_at 为空的是还在 listings 里的教材
+COLUMNS = ('id', 'title', 'author', 'isbn', 'publisher', 'seller_id', 'seller_name', 'price',
+           'condition', 'description', 'contact_method', 'contact_info', 'created_at', 'is_sold',
+           'archived_at')
+
+
+def iter_batches(conn, batch_size=EXPORT_BATCH_SIZE):
+    # fetchmany 按批从游标取数据，内存里最多只有一批行。
+    # 两张表在同一个读事务里导出，导出过程中被归档的教材不会出现两次
+    conn.execute('BEGIN')
+    try:
+        for sql in (queries.EXPORT_LISTINGS, queries.EXPORT_ARCHIVED_LISTINGS):
+            cursor = conn.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(zip(COLUMNS, row)) for row in rows]
+    finally:
+        conn.rollback()
+
+
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def ndjson_chunks(batches):
+    for batch in batches:
+        yield ''.join(_encode(record) + '\n' for record in batch).encode('utf-8')
+
+
+def json_array_chunks(batches):
+    yield b'['
+    first = True
+    for batch in batches:
+        text = ','.join(_encode(record) for record in batch)
+        yield (text if first else ',' + text).encode('utf-8')
+        first = False
+    yield b']'
+
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson; charset=utf-8', ndjson_chunks),
+    'json': ('application/json; charset=utf-8', json_array_chunks),
+}
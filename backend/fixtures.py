@@ -0,0 +1,77 @@
+# 几个后端共用的演示数据；simple_server 用它初始化课程表，另外两个服务通过 repository.MemoryRepository 返回
+COURSE_TREE = {
+    "计算机科学": {
+        "第一学期": [
+            {"id": 1, "name": "高等数学", "code": "MATH001"},
+            {"id": 2, "name": "线性代数", "code": "MATH002"}
+        ],
+        "第二学期": [
+            {"id": 3, "name": "数据结构", "code": "CS002"}
+        ]
+    },
+    "通用课程": {
+        "第一学期": [
+            {"id": 4, "name": "大学英语", "code": "ENG001"}
+        ]
+    }
+}
+
+# 内存仓库里的在售教材，字段和 listings 表一致
+LISTINGS = [
+    {
+        "id": 1,
+        "title": "高等数学教材",
+        "author": "张三",
+        "isbn": "9787111234567",
+        "publisher": "高等教育出版社",
+        "seller_id": 1,
+        "seller_name": "李四",
+        "price": 25.0,
+        "condition": "8成新",
+        "description": "课本保存良好，无涂画",
+        "course_id": 1,
+        "created_at": "2024-01-15T10:30:00"
+    },
+    {
+        "id": 2,
+        "title": "数据结构与算法",
+        "author": "王五",
+        "isbn": "9787111234568",
+        "publisher": "清华大学出版社",
+        "seller_id": 2,
+        "seller_name": "赵六",
+        "price": 35.0,
+        "condition": "9成新",
+        "description": "几乎全新，仅翻阅过几次",
+        "course_id": 3,
+        "created_at": "2024-01-16T14:20:00"
+    },
+    {
+        "id": 3,
+        "title": "线性代数",
+        "author": "陈七",
+        "isbn": "9787111234569",
+        "publisher": "高等教育出版社",
+        "seller_id": 3,
+        "seller_name": "孙八",
+        "price": 20.0,
+        "condition": "7成新",
+        "description": "有少量笔记，不影响阅读",
+        "course_id": 2,
+        "created_at": "2024-01-17T09:15:00"
+    }
+]
+
+
+# 演示服务的 ISBN 查询和二维码都返回固定内容
+def sample_book(isbn):
+    return {
+        'isbn': isbn,
+        'title': f'示例教材-{isbn[-4:] if isbn else "0000"}',
+        'author': '示例作者',
+        'publisher': '示例出版社',
+        'year': '2023'
+    }
+
+
+SAMPLE_QR_CODE = 'data:image/svg+xml;base64,PD94bWwgdmVyc2lvbj0iMS4wIiBlbmNvZGluZz0iVVRGLTgiPz4KPHN2ZyB3aWR0aD0iMTAwIiBoZWlnaHQ9IjEwMCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KICA8cmVjdCB3aWR0aD0iMTAwIiBoZWlnaHQ9IjEwMCIgZmlsbD0iI2ZmZiIvPgogIDx0ZXh0IHg9IjUwIiB5PSI1MCIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZHk9Ii4zZW0iIGZvbnQtZmFtaWx5PSJtb25vc3BhY2UiIGZvbnQtc2l6ZT0iMTAiPuS6jOe7tOeggeWwseeUn+aIkDwvdGV4dD4KPC9zdmc+'
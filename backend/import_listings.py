@@ -0,0 +1,86 @@
+import argparse
+import csv
+import json
+import sys
+import time
+
+import db
+import listings
+import migrations
+
+# 用法:
+#   python import_listings.py books.csv --seller-id 3 --seller-name 张三
+#   python import_listings.py books.ndjson --db /path/to/textbook_exchange.db
+# CSV 第一行是表头，列名和 /api/publish 的字段一致；NDJSON 每行一个 JSON 对象。
+# 表头/对象里带 seller_id、seller_name 时优先使用，否则用命令行参数。
+
+
+def read_records(path, fmt):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, None
+
+
+def run_import(conn, records, seller_id, seller_name, batch_size):
+    inserted = 0
+    errors = []
+    batch = []
+    # 整个文件在一个事务里导入，每 batch_size 行调用一次 executemany
+    with conn:
+        for line_no, record in records:
+            try:
+                listing = listings.validate_listing(record)
+            except listings.ListingError as e:
+                errors.append((line_no, str(e)))
+                continue
+            row_seller_id = record.get('seller_id') or seller_id
+            row_seller_name = record.get('seller_name') or seller_name
+            batch.append(listings.insert_params(listing, row_seller_id, row_seller_name))
+            if len(batch) >= batch_size:
+                inserted += listings.insert_many(conn, batch)
+                batch = []
+        if batch:
+            inserted += listings.insert_many(conn, batch)
+    return inserted, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从 CSV 或 NDJSON 文件批量导入二手教材')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'ndjson'],
+                        help='默认根据扩展名判断，.csv 以外都按 NDJSON 处理')
+    parser.add_argument('--db', help='数据库路径，默认 textbook_exchange.db')
+    parser.add_argument('--seller-id', type=int, default=None)
+    parser.add_argument('--seller-name', default='匿名用户')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.path.lower().endswith('.csv') else 'ndjson')
+    conn = db.connect(args.db)
+    migrations.migrate(conn)
+
+    start = time.perf_counter()
+    inserted, errors = run_import(conn, read_records(args.path, fmt),
+                                  args.seller_id, args.seller_name, args.batch_size)
+    elapsed = time.perf_counter() - start
+    conn.close()
+
+    for line_no, message in errors[:50]:
+        print(f'第 {line_no} 行: {message}', file=sys.stderr)
+    if len(errors) > 50:
+        print(f'... 另有 {len(errors) - 50} 行错误未显示', file=sys.stderr)
+    print(f'✅ 导入 {inserted} 本，失败 {len(errors)} 行，用时 {elapsed:.2f} 秒')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta, timezone
+
+import queries
+
+# 数据来源由 TEXTBOOK_ISBN_PROVIDER 指定:
+#   留空            使用随代码附带的 isbn_dump.json
+#   /path/dump.json 本地导出文件（JSON 对象或每行一个对象的 NDJSON）
+#   http://host:port/isbn/{isbn}  HTTP 服务，200 返回 JSON，404 表示查无此书
+DEFAULT_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'isbn_dump.json')
+POSITIVE_TTL = timedelta(days=float(os.environ.get('TEXTBOOK_ISBN_TTL_DAYS', '30')))
+NEGATIVE_TTL = timedelta(days=float(os.environ.get('TEXTBOOK_ISBN_NEGATIVE_TTL_DAYS', '1')))
+PROVIDER_TIMEOUT = float(os.environ.get('TEXTBOOK_ISBN_TIMEOUT', '5'))
+# 请求线程最多等这么久；上游更慢时先返回 503，后台查完照样写进缓存
+LOOKUP_WAIT = float(os.environ.get('TEXTBOOK_ISBN_WAIT', '2'))
+FETCH_WORKERS = 4
+MAX_INFLIGHT = 64
+
+FIELDS = ('title', 'author', 'publisher', 'year')
+
+
+class InvalidISBN(ValueError):
+    pass
+
+
+class ProviderError(Exception):
+    pass
+
+
+class LookupPending(Exception):
+    pass
+
+
+def normalize(raw):
+    # 统一成不带连字符的 ISBN-13；ISBN-10 补 978 前缀并重算校验位
+    digits = ''.join(ch for ch in str(raw or '') if ch not in ' -').upper()
+    if len(digits) == 10 and digits[:9].isdigit() and (digits[9].isdigit() or digits[9] == 'X'):
+        total = sum((10 - i) * int(d) for i, d in enumerate(digits[:9]))
+        total += 10 if digits[9] == 'X' else int(digits[9])
+        if total % 11:
+            raise InvalidISBN(raw)
+        digits = '978' + digits[:9]
+        return digits + _check13(digits)
+    if len(digits) == 13 and digits.isdigit() and digits[:3] in ('978', '979'):
+        if _check13(digits[:12]) != digits[12]:
+            raise InvalidISBN(raw)
+        return digits
+    raise InvalidISBN(raw)
+
+
+def _check13(first12):
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def _metadata(record):
+    return {field: str(record.get(field) or '') for field in FIELDS}
+
+
+class DumpProvider:
+    def __init__(self, path=DEFAULT_DUMP):
+        self.path = path
+        self._books = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            text = f.read()
+        if text.lstrip().startswith('{') and not self.path.endswith('.ndjson'):
+            records = [dict(record, isbn=key) for key, record in json.loads(text).items()]
+        else:
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        books = {}
+        for record in records:
+            try:
+                books[normalize(record.get('isbn'))] = _metadata(record)
+            except InvalidISBN:
+                continue
+        return books
+
+    def fetch(self, isbn):
+        with self._lock:
+            if self._books is None:
+                try:
+                    self._books = self._load()
+                except (OSError, ValueError) as e:
+                    raise ProviderError(f'读取 {self.path} 失败: {e}')
+        return self._books.get(isbn)
+
+
+class HTTPProvider:
+    def __init__(self, url_template, timeout=PROVIDER_TIMEOUT):
+        self.url_template = url_template
+        self.timeout = timeout
+
+    def fetch(self, isbn):
+        url = self.url_template.replace('{isbn}', urllib.parse.quote(isbn))
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return _metadata(json.load(response))
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise ProviderError(f'上游返回 {e.code}')
+        except (OSError, ValueError) as e:
+            raise ProviderError(str(e))
+
+
+def provider_from_env():
+    source = os.environ.get('TEXTBOOK_ISBN_PROVIDER', '')
+    if source.startswith(('http://', 'https://')):
+        return HTTPProvider(source)
+    return DumpProvider(source or DEFAULT_DUMP)
+
+
+def _expiry(ttl):
+    return (datetime.now(timezone.utc) + ttl).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class IsbnLookup:
+    # 先查 isbn_metadata 缓存表；没命中才交给后台线程向上游查询。
+    # 同一个 ISBN 同时只有一次上游请求，其余请求等同一个 future
+    def __init__(self, provider, store, workers=FETCH_WORKERS, wait=LOOKUP_WAIT):
+        self.provider = provider
+        # store(sql, params) 负责写缓存表，服务器里传写队列的 execute
+        self.store = store
+        self.wait = wait
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='isbn-fetch')
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.fetches = 0
+        self.coalesced = 0
+
+    def lookup(self, conn, raw):
+        # 返回 (规范化后的 ISBN-13, 元数据字典)；查无此书时元数据为 None
+        isbn = normalize(raw)
+        row = conn.execute(queries.ISBN_METADATA_BY_ISBN, (isbn,)).fetchone()
+        if row is not None:
+            with self._lock:
+                self.hits += 1
+            return isbn, (dict(zip(FIELDS, row[1:])) if row[0] else None)
+        future = self._fetch(isbn)
+        try:
+            return isbn, future.result(timeout=self.wait)
+        except FutureTimeout:
+            raise LookupPending(isbn)
+
+    def _fetch(self, isbn):
+        with self._lock:
+            future = self._inflight.get(isbn)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if len(self._inflight) >= MAX_INFLIGHT:
+                raise LookupPending(isbn)
+            self.fetches += 1
+            future = self._pool.submit(self._load, isbn)
+            self._inflight[isbn] = future
+            return future
+
+    def _load(self, isbn):
+        try:
+            metadata = self.provider.fetch(isbn)
+            if metadata is None:
+                params = (isbn, 0, None, None, None, None, _expiry(NEGATIVE_TTL))
+            else:
+                params = (isbn, 1) + tuple(metadata[field] for field in FIELDS) + (_expiry(POSITIVE_TTL),)
+            try:
+                self.store(queries.UPSERT_ISBN_METADATA, params)
+            except Exception:
+                # 缓存没写进去只影响下一次命中率，本次结果照常返回
+                pass
+            return metadata
+        finally:
+            # 缓存写完才移出 inflight，之后到达的请求一定能在表里查到
+            with self._lock:
+                self._inflight.pop(isbn, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'fetches': self.fetches, 'coalesced': self.coalesced,
+                    'inflight': len(self._inflight)}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
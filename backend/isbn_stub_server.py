@@ -0,0 +1,44 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import isbn
+
+# 本地开发用的 ISBN 上游替身，把导出文件按 HTTP 接口提供出去:
+#   python isbn_stub_server.py --port 8081 --delay 3
+#   TEXTBOOK_ISBN_PROVIDER=http://localhost:8081/isbn/{isbn} python simple_server.py
+# --delay 用来模拟慢上游，检查服务器在上游卡住时的表现
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ISBN 元数据上游替身')
+    parser.add_argument('--dump', default=isbn.DEFAULT_DUMP)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0, help='每个请求额外等待的秒数')
+    args = parser.parse_args()
+    provider = isbn.DumpProvider(args.dump)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(args.delay)
+            prefix = '/isbn/'
+            metadata = None
+            if self.path.startswith(prefix):
+                try:
+                    metadata = provider.fetch(isbn.normalize(self.path[len(prefix):]))
+                except isbn.InvalidISBN:
+                    pass
+            body = json.dumps(metadata or {'error': 'Not found'}, ensure_ascii=False).encode('utf-8')
+            self.send_response(200 if metadata else 404)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f'ISBN 上游替身: http://localhost:{args.port}/isbn/{{isbn}}')
+    ThreadingHTTPServer(('', args.port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import json
+import math
+
+import queries
+import search
+
+# 单条发布、批量发布和导入脚本共用同一套校验
+MAX_BATCH_SIZE = 1000
+MAX_FILTER_VALUES = 20
+
+
+class ListingError(ValueError):
+    pass
+
+
+def _course_id(value):
+    # int() 能解析任意长的数字，超出 SQLite 整数范围的要在绑定参数前拒绝
+    course_id = int(value)
+    if not queries.in_integer_range(course_id):
+        raise ValueError(value)
+    return course_id
+
+
+def _number(value):
+    # float() 也接受 'nan'、'inf'：NaN 写入时违反 NOT NULL，inf 能存进去但输出成不合法的 JSON
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def _text(record, key, default=''):
+    value = record.get(key)
+    if value is None:
+        return default
+    return str(value).strip()
+
+
+def validate_listing(record):
+    if not isinstance(record, dict):
+        raise ListingError('每条记录必须是 JSON 对象')
+    title = _text(record, 'title')
+    contact_info = _text(record, 'contact_info')
+    price = record.get('price') or 0
+    if not title or not price or not contact_info:
+        raise ListingError('请填写必要信息')
+    try:
+        price = _number(price)
+    except (TypeError, ValueError):
+        raise ListingError('价格无效')
+    if price <= 0:
+        raise ListingError('价格无效')
+    course_id = record.get('course_id')
+    if course_id in (None, ''):
+        course_id = None
+    else:
+        try:
+            course_id = _course_id(course_id)
+        except (TypeError, ValueError):
+            raise ListingError('课程无效')
+    return {
+        'title': title,
+        'author': _text(record, 'author'),
+        'isbn': _text(record, 'isbn'),
+        'publisher': _text(record, 'publisher'),
+        'price': price,
+        'condition': _text(record, 'condition') or '8成新',
+        'description': _text(record, 'description'),
+        'contact_method': _text(record, 'contact_method') or 'wechat',
+        'contact_info': contact_info,
+        'course_id': course_id,
+    }
+
+
+def parse_version(record):
+    # 修改类操作都要带上读到的 version，和数据库里的不一致就说明期间被别人改过
+    version = record.get('version') if isinstance(record, dict) else None
+    if isinstance(version, bool) or not isinstance(version, int) or version < 0 \
+            or not queries.in_integer_range(version):
+        raise ListingError('请提供教材的 version')
+    return version
+
+
+def validate_changes(record):
+    # 卖家修改在售教材：只校验提供了的字段，没提供的返回 None，保持原值
+    changes = {}
+    if record.get('price') not in (None, ''):
+        try:
+            price = _number(record['price'])
+        except (TypeError, ValueError):
+            raise ListingError('价格无效')
+        if price <= 0:
+            raise ListingError('价格无效')
+        changes['price'] = price
+    for key in ('condition', 'description', 'contact_method', 'contact_info'):
+        if record.get(key) is not None:
+            changes[key] = _text(record, key)
+            # 描述可以清空，其余字段不能改成空
+            if not changes[key] and key != 'description':
+                raise ListingError('请填写必要信息')
+    if not changes:
+        raise ListingError('没有需要修改的内容')
+    description = changes.get('description')
+    return (changes.get('price'), changes.get('condition'), description,
+            None if description is None else search.bigram_text(description),
+            changes.get('contact_method'), changes.get('contact_info'))
+
+
+def insert_params(listing, seller_id, seller_name):
+    # 顺序和 queries.INSERT_LISTING 的列一致，最后是全文检索用的分词列
+    return (listing['title'], listing['author'], listing['isbn'], listing['publisher'],
+            seller_id, seller_name, listing['price'], listing['condition'],
+            listing['description'], listing['contact_method'], listing['contact_info'],
+            listing['course_id'], *(search.bigram_text(listing[column]) for column in search.TOKEN_COLUMNS))
+
+
+def _price(value, name):
+    try:
+        price = _number(value)
+    except ValueError:
+        raise ListingError(f'{name} 必须是数字')
+    if price < 0:
+        raise ListingError(f'{name} 不能为负数')
+    return price
+
+
+def parse_filters(query):
+    # query 是 parse_qs 的结果；多选的条件既可以重复参数，也可以逗号分隔
+    filters = {}
+    for name in queries.LISTING_FILTERS:
+        values = [value.strip() for raw in query.get(name, []) for value in raw.split(',') if value.strip()]
+        if name == 'course_id':
+            try:
+                values = [_course_id(value) for value in values]
+            except ValueError:
+                raise ListingError('course_id 必须是整数')
+        if len(values) > MAX_FILTER_VALUES:
+            raise ListingError(f'{name} 最多选 {MAX_FILTER_VALUES} 项')
+        if values:
+            filters[name] = sorted(set(values))
+    for name in ('min_price', 'max_price'):
+        value = query.get(name, [''])[0]
+        if value:
+            filters[name] = _price(value, name)
+    has_range = 'min_price' in filters or 'max_price' in filters
+    # 限定价格区间时没有索引能按发布时间排序，默认改成按价格从低到高
+    sort = query.get('sort', [''])[0] or ('price_asc' if has_range else 'newest')
+    if sort not in queries.LISTING_SORTS:
+        raise ListingError(f'sort 只支持 {", ".join(queries.LISTING_SORTS)}')
+    if has_range and queries.LISTING_SORTS[sort][0] != 'price':
+        raise ListingError('限定价格区间时只能按价格排序（sort=price_asc 或 price_desc）')
+    return filters, sort
+
+
+def validate_batch(records, seller_id, seller_name):
+    params = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            params.append(insert_params(validate_listing(record), seller_id, seller_name))
+        except ListingError as e:
+            errors.append({'index': index, 'message': str(e)})
+    return params, errors
+
+
+def parse_batch_body(body, content_type):
+    # 接受 JSON 数组或 NDJSON（每行一个 JSON 对象）；无法解析的行记为该行的错误
+    text = body.decode('utf-8')
+    if 'ndjson' not in (content_type or '') and text.lstrip().startswith('['):
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ListingError('请求体必须是 JSON 数组或 NDJSON')
+        return records
+    records = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            records.append(None)
+    return records
+
+
+def insert_many(conn, params):
+    # 调用方负责事务；executemany 复用同一条预编译语句
+    conn.executemany(queries.INSERT_LISTING, params)
+    return len(params)
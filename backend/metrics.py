@@ -0,0 +1,142 @@
+import bisect
+import threading
+
+# 每个线程只写自己的一份计数，记录时不加锁；抓取 /metrics 时再把各线程的数据加总
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+class _Shard:
+    def __init__(self):
+        self.requests = {}
+        # (route, method) -> [各桶计数..., 总耗时]
+        self.durations = {}
+        self.bytes_in = {}
+        self.bytes_out = {}
+        self.in_flight = 0
+        self.db_connect = [0, 0.0]
+        self.db_query = [0, 0.0]
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def request_started():
+    _shard().in_flight += 1
+
+
+def request_finished(route, method, status, seconds, bytes_in, bytes_out):
+    shard = _shard()
+    shard.in_flight -= 1
+    key = (route, method, status)
+    shard.requests[key] = shard.requests.get(key, 0) + 1
+    key = (route, method)
+    histogram = shard.durations.get(key)
+    if histogram is None:
+        histogram = shard.durations[key] = [0] * (len(BUCKETS) + 2)
+    histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+    histogram[-1] += seconds
+    if bytes_in:
+        shard.bytes_in[route] = shard.bytes_in.get(route, 0) + bytes_in
+    if bytes_out:
+        shard.bytes_out[route] = shard.bytes_out.get(route, 0) + bytes_out
+
+
+def observe_connect(seconds):
+    stats = _shard().db_connect
+    stats[0] += 1
+    stats[1] += seconds
+
+
+def observe_query(seconds, statements=1):
+    # 取结果的耗时也算查询时间，但不增加语句数
+    stats = _shard().db_query
+    stats[0] += statements
+    stats[1] += seconds
+
+
+def _merge_counts(attr):
+    total = {}
+    for shard in _snapshot():
+        for key, value in getattr(shard, attr).copy().items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def _snapshot():
+    with _shards_lock:
+        return list(_shards)
+
+
+def _labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(extra_counters=()):
+    # extra_counters: (名称, 说明, 数值) 的序列，放服务器其他模块自己维护的计数
+    lines = []
+
+    def header(name, help_text, kind):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    header('textbook_http_requests_total', 'HTTP requests by route, method and status.', 'counter')
+    for key, value in sorted(_merge_counts('requests').items()):
+        lines.append(f'textbook_http_requests_total{_labels(("route", "method", "status"), key)} {value}')
+
+    header('textbook_http_request_duration_seconds', 'HTTP request latency.', 'histogram')
+    durations = {}
+    for shard in _snapshot():
+        for key, histogram in shard.durations.copy().items():
+            merged = durations.setdefault(key, [0] * len(histogram))
+            for i, value in enumerate(histogram):
+                merged[i] += value
+    for (route, method), histogram in sorted(durations.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram):
+            cumulative += count
+            labels = _labels(('route', 'method', 'le'), (route, method, bound))
+            lines.append(f'textbook_http_request_duration_seconds_bucket{labels} {cumulative}')
+        labels = _labels(('route', 'method'), (route, method))
+        lines.append(f'textbook_http_request_duration_seconds_sum{labels} {_format(histogram[-1])}')
+        lines.append(f'textbook_http_request_duration_seconds_count{labels} {cumulative}')
+
+    for attr, name, help_text in (('bytes_in', 'textbook_http_request_bytes_total', 'Request body bytes received.'),
+                                  ('bytes_out', 'textbook_http_response_bytes_total', 'Response body bytes sent.')):
+        header(name, help_text, 'counter')
+        for route, value in sorted(_merge_counts(attr).items()):
+            lines.append(f'{name}{_labels(("route",), (route,))} {value}')
+
+    shards = _snapshot()
+    header('textbook_http_requests_in_flight', 'Requests currently being handled.', 'gauge')
+    lines.append(f'textbook_http_requests_in_flight {sum(shard.in_flight for shard in shards)}')
+
+    for attr, name, help_text in (('db_connect', 'textbook_sqlite_connect_seconds', 'Time spent opening SQLite connections.'),
+                                  ('db_query', 'textbook_sqlite_query_seconds', 'Time spent executing SQLite statements and fetching rows.')):
+        header(name, help_text, 'summary')
+        count = sum(getattr(shard, attr)[0] for shard in shards)
+        seconds = sum(getattr(shard, attr)[1] for shard in shards)
+        lines.append(f'{name}_sum {_format(seconds)}')
+        lines.append(f'{name}_count {count}')
+
+    for name, help_text, value in extra_counters:
+        header(name, help_text, 'counter')
+        lines.append(f'{name} {_format(value)}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
@@ -0,0 +1,640 @@
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import db
+import fixtures
+import queries
+import search
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+def add_column(conn, table, name, definition):
+    # SQLite 没有 ADD COLUMN IF NOT EXISTS，先查表结构保证可重复执行
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if name not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+
+@migration(1, '基础表结构')
+def create_base_tables(conn):
+    # 保留 IF NOT EXISTS，这样已有的 textbook_exchange.db 可以原地升级
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            major TEXT,
+            grade TEXT,
+            student_id TEXT,
+            phone TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS listings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            author TEXT,
+            isbn TEXT,
+            publisher TEXT,
+            seller_id INTEGER,
+            seller_name TEXT,
+            price REAL NOT NULL,
+            condition TEXT,
+            description TEXT,
+            contact_method TEXT,
+            contact_info TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_sold BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (seller_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            session_token TEXT UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+
+@migration(2, '二级索引')
+def add_secondary_indexes(conn):
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_listings_feed
+        ON listings (is_sold, created_at DESC, id DESC)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_isbn ON listings (isbn)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_seller ON listings (seller_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)')
+
+
+@migration(3, '教材全文检索')
+def add_listings_fts(conn):
+    # 普通 FTS5 表，存的是 cjk_bigrams 处理后的文本；只索引在售的书。
+    # 触发器里调用的 cjk_bigrams 只有 db.connect 的连接注册了，迁移 12 改成了不依赖 Python 函数的做法
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(
+            title, author, publisher, description,
+            tokenize = 'unicode61'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS listings_fts_insert AFTER INSERT ON listings
+        WHEN new.is_sold = FALSE
+        BEGIN
+            INSERT INTO listings_fts (rowid, title, author, publisher, description)
+            VALUES (new.id, cjk_bigrams(new.title), cjk_bigrams(new.author),
+                    cjk_bigrams(new.publisher), cjk_bigrams(new.description));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS listings_fts_update
+        AFTER UPDATE OF title, author, publisher, description, is_sold ON listings
+        BEGIN
+            DELETE FROM listings_fts WHERE rowid = old.id;
+            INSERT INTO listings_fts (rowid, title, author, publisher, description)
+            SELECT new.id, cjk_bigrams(new.title), cjk_bigrams(new.author),
+                   cjk_bigrams(new.publisher), cjk_bigrams(new.description)
+            WHERE new.is_sold = FALSE;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS listings_fts_delete AFTER DELETE ON listings
+        BEGIN
+            DELETE FROM listings_fts WHERE rowid = old.id;
+        END
+    ''')
+    conn.execute('''
+        INSERT INTO listings_fts (rowid, title, author, publisher, description)
+        SELECT id, cjk_bigrams(title), cjk_bigrams(author),
+               cjk_bigrams(publisher), cjk_bigrams(description)
+        FROM listings
+        WHERE is_sold = FALSE AND id NOT IN (SELECT rowid FROM listings_fts)
+    ''')
+
+
+@migration(4, '课程目录')
+def add_course_catalogue(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS majors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            sort_order INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS semesters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            sort_order INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            code TEXT UNIQUE NOT NULL,
+            major_id INTEGER NOT NULL,
+            semester_id INTEGER NOT NULL,
+            sort_order INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (major_id) REFERENCES majors (id),
+            FOREIGN KEY (semester_id) REFERENCES semesters (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalogue_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO catalogue_meta (id, version) VALUES (1, 1)')
+    # 目录表的任何改动都让版本号加一，服务器据此重建内存中的课程树
+    for table in ('majors', 'semesters', 'courses'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_bump_catalogue
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE catalogue_meta SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+    
+    semester_ids = {}
+    for major_order, (major, semesters) in enumerate(fixtures.COURSE_TREE.items()):
+        conn.execute('INSERT OR IGNORE INTO majors (name, sort_order) VALUES (?, ?)',
+                     (major, major_order))
+        major_id = conn.execute('SELECT id FROM majors WHERE name = ?', (major,)).fetchone()[0]
+        for semester, courses in semesters.items():
+            if semester not in semester_ids:
+                conn.execute('INSERT OR IGNORE INTO semesters (name, sort_order) VALUES (?, ?)',
+                             (semester, len(semester_ids)))
+                semester_ids[semester] = conn.execute(
+                    'SELECT id FROM semesters WHERE name = ?', (semester,)).fetchone()[0]
+            for course_order, course in enumerate(courses):
+                conn.execute('''
+                    INSERT OR IGNORE INTO courses (id, name, code, major_id, semester_id, sort_order)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (course['id'], course['name'], course['code'], major_id,
+                      semester_ids[semester], course_order))
+
+
+@migration(5, 'ISBN 元数据缓存')
+def add_isbn_metadata(conn):
+    # found = 0 的行是查不到的 ISBN，过期时间比查到的短，避免同一个坏 ISBN 反复请求上游
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS isbn_metadata (
+            isbn TEXT PRIMARY KEY,
+            found INTEGER NOT NULL,
+            title TEXT,
+            author TEXT,
+            publisher TEXT,
+            year TEXT,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+
+# 价格区间的边界，listing_facets 里 price 分面的取值就是这些区间
+PRICE_BANDS = (10, 20, 30, 50)
+
+
+def price_band_sql(column):
+    cases = []
+    lower = 0
+    for upper in PRICE_BANDS:
+        cases.append(f"WHEN {column} < {upper} THEN '{lower}-{upper}'")
+        lower = upper
+    return f"CASE {' '.join(cases)} ELSE '{lower}+' END"
+
+
+def _facet_values(row):
+    # (分面名, 取值表达式)，row 是触发器里的 new / old 或者回填时的表名
+    return (
+        ('condition', f"COALESCE({row}.condition, '')"),
+        ('publisher', f"COALESCE({row}.publisher, '')"),
+        ('course_id', f"COALESCE(CAST({row}.course_id AS TEXT), '')"),
+        ('price', price_band_sql(f'{row}.price')),
+    )
+
+
+def create_listing_facet_triggers(conn):
+    # 只统计在售的书：上架 +1，售出、删除 -1，改了分面字段就旧值 -1、新值 +1
+    increments = '\n'.join(f"""
+            INSERT INTO listing_facets (facet, value, count) VALUES ('{facet}', {value}, 1)
+            ON CONFLICT (facet, value) DO UPDATE SET count = count + 1;""" for facet, value in _facet_values('new'))
+    decrements = '\n'.join(f"""
+            UPDATE listing_facets SET count = count - 1
+            WHERE facet = '{facet}' AND value = {value};""" for facet, value in _facet_values('old'))
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS listing_facets_insert AFTER INSERT ON listings
+        WHEN new.is_sold = FALSE
+        BEGIN{increments}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS listing_facets_remove
+        AFTER UPDATE OF condition, publisher, course_id, price, is_sold ON listings
+        WHEN old.is_sold = FALSE
+        BEGIN{decrements}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS listing_facets_add
+        AFTER UPDATE OF condition, publisher, course_id, price, is_sold ON listings
+        WHEN new.is_sold = FALSE
+        BEGIN{increments}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS listing_facets_delete AFTER DELETE ON listings
+        WHEN old.is_sold = FALSE
+        BEGIN{decrements}
+        END
+    ''')
+
+
+def rebuild_listing_facets(conn):
+    conn.execute('DELETE FROM listing_facets')
+    for facet, value in _facet_values('listings'):
+        conn.execute(f'''
+            INSERT INTO listing_facets (facet, value, count)
+            SELECT '{facet}', {value}, COUNT(*) FROM listings
+            WHERE is_sold = FALSE
+            GROUP BY 2
+        ''')
+
+
+@migration(6, '分面筛选')
+def add_listing_facets(conn):
+    add_column(conn, 'listings', 'course_id', 'INTEGER')
+    # 每种筛选条件一条复合索引，默认按发布时间倒序翻页时不需要额外排序
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_listings_condition
+        ON listings (is_sold, condition, created_at DESC, id DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_listings_publisher
+        ON listings (is_sold, publisher, created_at DESC, id DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_listings_course
+        ON listings (is_sold, course_id, created_at DESC, id DESC)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_price ON listings (is_sold, price, id)')
+    # 各分面取值的在售数量，由触发器增量维护，查询分面时不用扫 listings
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS listing_facets (
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (facet, value)
+        ) WITHOUT ROWID
+    ''')
+    create_listing_facet_triggers(conn)
+    rebuild_listing_facets(conn)
+
+
+@migration(7, '归档表')
+def add_listings_archive(conn):
+    # 已售出和过期的教材由 archive.Compactor 从 listings 移到这里，listings 只留在售的热数据。
+    # id 沿用 listings 的 id（AUTOINCREMENT 不会复用），所以不会冲突
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS listings_archive (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            author TEXT,
+            isbn TEXT,
+            publisher TEXT,
+            seller_id INTEGER,
+            seller_name TEXT,
+            price REAL NOT NULL,
+            condition TEXT,
+            description TEXT,
+            contact_method TEXT,
+            contact_info TEXT,
+            course_id INTEGER,
+            created_at TIMESTAMP,
+            is_sold BOOLEAN,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_archive_isbn
+        ON listings_archive (isbn, archived_at DESC, id DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_archive_seller
+        ON listings_archive (seller_id, archived_at DESC, id DESC)
+    ''')
+
+
+@migration(8, '教材状态版本号')
+def add_listing_versions(conn):
+    # 预订、售出、修改、下架都用 UPDATE ... WHERE version = ? 做条件更新，每次成功都把 version 加一
+    add_column(conn, 'listings', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'listings', 'reserved_by', 'INTEGER')
+    add_column(conn, 'listings', 'reserved_until', 'TIMESTAMP')
+
+
+# 迁移 9 建的索引，seed_data.py 批量写入前也会删掉重建
+PRICE_FILTER_INDEXES = {
+    'idx_listings_condition_price': 'condition',
+    'idx_listings_publisher_price': 'publisher',
+    'idx_listings_course_price': 'course_id',
+}
+
+
+@migration(9, '按价格排序的筛选索引')
+def add_price_filter_indexes(conn):
+    # 按条件筛选再按价格排序或限定价格区间时，沿这些索引能直接按价格顺序取到一页
+    for index, column in PRICE_FILTER_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {index} ON listings (is_sold, {column}, price, id)')
+    # 已经有统计信息的库（比如 seed_data.py 造的）给新索引补上统计，否则查询规划器只能按默认值估算
+    if has_statistics(conn):
+        for index in PRICE_FILTER_INDEXES:
+            conn.execute(f'ANALYZE {index}')
+
+
+def create_listings_version_triggers(conn):
+    # 在售表和归档表的任何改动都让 listings_meta.version 加一；服务器的响应缓存据此发现
+    # 导入脚本、seed_data.py 或手工 SQL 这些别的进程写入的数据
+    for table in ('listings', 'listings_archive'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_bump_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE listings_meta SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+
+@migration(10, '教材数据版本号')
+def add_listings_meta(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS listings_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO listings_meta (id, version) VALUES (1, 1)')
+    create_listings_version_triggers(conn)
+
+
+@migration(11, '全文检索单字索引')
+def rebuild_listings_fts(conn):
+    # cjk_bigrams 开始额外输出单个汉字，已有的索引按新的分词重建，单字搜索才能找到词中间的字
+    conn.execute('DELETE FROM listings_fts')
+    conn.execute('''
+        INSERT INTO listings_fts (rowid, title, author, publisher, description)
+        SELECT id, cjk_bigrams(title), cjk_bigrams(author),
+               cjk_bigrams(publisher), cjk_bigrams(description)
+        FROM listings
+        WHERE is_sold = FALSE
+    ''')
+
+
+def create_listings_fts_triggers(conn):
+    # 触发器只在 listings 的分词列和全文索引之间搬运，不调用 Python 函数，sqlite3 命令行之类的客户端也能直接改表。
+    # 外部内容表删除时要给出当初写入的值，所以只对在售（在索引里）的行做 delete。
+    # seed_data.py 批量写入前会删掉插入触发器，写完再调用这里补回来
+    columns = ', '.join(f'{column}_tokens' for column in search.TOKEN_COLUMNS)
+    old_values = ', '.join(f'old.{column}_tokens' for column in search.TOKEN_COLUMNS)
+    new_values = ', '.join(f'new.{column}_tokens' for column in search.TOKEN_COLUMNS)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS listings_fts_insert AFTER INSERT ON listings
+        WHEN new.is_sold = FALSE
+        BEGIN
+            INSERT INTO listings_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS listings_fts_update
+        AFTER UPDATE OF {columns}, is_sold ON listings
+        BEGIN
+            INSERT INTO listings_fts (listings_fts, rowid, {columns})
+            SELECT 'delete', old.id, {old_values} WHERE old.is_sold = FALSE;
+            INSERT INTO listings_fts (rowid, {columns})
+            SELECT new.id, {new_values} WHERE new.is_sold = FALSE;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS listings_fts_delete AFTER DELETE ON listings
+        WHEN old.is_sold = FALSE
+        BEGIN
+            INSERT INTO listings_fts (listings_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    ''')
+
+
+def fill_listings_fts(conn):
+    # 外部内容表按 rowid 查到的是 listings 的行，分不出哪些已经进了索引，所以清空后把在售的书整体重写一遍
+    columns = ', '.join(f'{column}_tokens' for column in search.TOKEN_COLUMNS)
+    conn.execute("INSERT INTO listings_fts (listings_fts) VALUES ('delete-all')")
+    conn.execute(f'INSERT INTO listings_fts (rowid, {columns}) SELECT id, {columns} FROM listings WHERE is_sold = FALSE')
+
+
+@migration(12, '全文索引改用应用写入的分词列')
+def move_search_tokens_to_listings(conn):
+    # 分词结果由应用在写入时算好（listings.insert_params），存在 listings 的 *_tokens 列里；
+    # listings_fts 改成以 listings 为外部内容的表，不再另存一份分词后的文本
+    for trigger in ('listings_fts_insert', 'listings_fts_update', 'listings_fts_delete'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    conn.execute('DROP TABLE IF EXISTS listings_fts')
+    for column in search.TOKEN_COLUMNS:
+        add_column(conn, 'listings', f'{column}_tokens', 'TEXT')
+    # 在售的行在这里补上分词（已售出的不进索引，不用存），迁移用的是 db.connect 的连接，注册了 cjk_bigrams
+    conn.execute('UPDATE listings SET ' + ', '.join(
+        f'{column}_tokens = cjk_bigrams({column})' for column in search.TOKEN_COLUMNS) + ' WHERE is_sold = FALSE')
+    columns = ', '.join(f'{column}_tokens' for column in search.TOKEN_COLUMNS)
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE listings_fts USING fts5(
+            {columns},
+            content = 'listings', content_rowid = 'id',
+            tokenize = 'unicode61'
+        )
+    ''')
+    create_listings_fts_triggers(conn)
+    fill_listings_fts(conn)
+
+
+def current_version(conn):
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    applied = []
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        # 每个版本一个事务；拿到写锁后再确认一次版本，避免多个进程同时升级
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            func(conn)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                         (version, description))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+# 执行计划里允许出现的 SCAN：常量行、虚拟表和子查询的结果（列表页多选时每段子查询都带 LIMIT），其余都算全表扫描
+_ALLOWED_SCAN = re.compile(r'SCAN (CONSTANT ROW|\S+ VIRTUAL TABLE|\(subquery-\d+\))')
+
+
+def planned_queries():
+    for name in dir(queries):
+        sql = getattr(queries, name)
+        if name in queries.FULL_SCANS or not (name.isupper() and isinstance(sql, str)):
+            continue
+        if not sql.lstrip().upper().startswith('INSERT'):
+            yield name, sql
+    # 列表页的 SQL 是拼出来的：每种排序配上单个筛选条件、多选、两个条件组合和价格区间，首页和翻页都查一遍
+    samples = [
+        {},
+        {'condition': ['8成新']},
+        {'publisher': ['高等教育出版社']},
+        {'course_id': [1]},
+        {'condition': ['8成新', '9成新']},
+        {'course_id': [1, 2, 3]},
+        {'condition': ['8成新'], 'publisher': ['高等教育出版社']},
+        {'condition': ['8成新', '9成新'], 'course_id': [1, 2]},
+        {'min_price': 10, 'max_price': 30},
+        {'course_id': [1], 'min_price': 10},
+        {'publisher': ['高等教育出版社', '清华大学出版社'], 'max_price': 30},
+    ]
+    for sort, (column, _, _) in queries.LISTING_SORTS.items():
+        for filters in samples:
+            if column != 'price' and ('min_price' in filters or 'max_price' in filters):
+                continue
+            for after in (None, ('', 0)):
+                label = f'filtered_listings({",".join(filters) or "-"}, {sort}{", after" if after else ""})'
+                yield label, queries.filtered_listings(filters, sort, after)[0]
+    for by in queries.ARCHIVE_LOOKUPS:
+        for after in (None, ('', 0)):
+            yield f'archived_listings({by}{", after" if after else ""})', queries.archived_listings(by, after)[0]
+
+
+# 区分度很低的列：带 LIMIT 的查询如果只靠它们定位索引范围，其余条件逐行检查，最坏要走完整个范围
+_LOW_SELECTIVITY = {'is_sold'}
+_WHERE_COLUMN = re.compile(r'\+?\b(\w+)\s*(?:=|>=|<=|\bIN\b)', re.IGNORECASE)
+_ORDER_COLUMN = re.compile(r'ORDER BY\s+(\w+)', re.IGNORECASE)
+_SEARCH_STEP = re.compile(r'SEARCH \S+ USING (?:COVERING )?INDEX \S+ \((.*)\)$')
+
+
+def _plan_problems(name, sql, plan):
+    # plan 是 EXPLAIN QUERY PLAN 的 (id, parent, detail)；返回不合格的原因列表
+    problems = []
+    limited = re.search(r'\bLIMIT\b', sql, re.IGNORECASE) is not None and name not in queries.RANKED_QUERIES
+    where = sql.upper().split('WHERE', 1)[1] if 'WHERE' in sql.upper() else ''
+    ordered = {column.lower() for column in _ORDER_COLUMN.findall(sql)} | {'id'}
+    filtered = {column.lower() for column in _WHERE_COLUMN.findall(where)} - ordered - _LOW_SELECTIVITY
+    children = {}
+    for step_id, parent, detail in plan:
+        children.setdefault(parent, []).append(detail)
+    # 带别名的子查询先物化成临时结果，之后的 SCAN 别名读的是这份结果（比如搜索的候选集），不是表
+    subqueries = {detail.split()[-1] for _, _, detail in plan if detail.startswith(('MATERIALIZE ', 'CO-ROUTINE '))}
+    for step_id, parent, detail in plan:
+        if detail.startswith('SCAN ') and not _ALLOWED_SCAN.match(detail) and detail[5:] not in subqueries:
+            problems.append(f'全表扫描: {detail}')
+        if not limited:
+            continue
+        if detail == 'USE TEMP B-TREE FOR ORDER BY':
+            # 对带 LIMIT 的子查询结果排序只涉及几页数据；对表或索引的查找结果排序则要先取出全部匹配行
+            siblings = [step for step in children[parent] if step != detail]
+            if not siblings or not all(step.startswith(('SCAN (subquery-', 'CO-ROUTINE ')) for step in siblings):
+                problems.append('分页查询需要对全部匹配行排序: USE TEMP B-TREE FOR ORDER BY')
+        lookup = _SEARCH_STEP.match(detail)
+        if lookup and filtered:
+            used = {column.lower() for column in re.findall(r'(\w+)\s*[=<>]', lookup.group(1))}
+            if not (used - ordered - _LOW_SELECTIVITY):
+                problems.append(f'分页查询只用 {", ".join(sorted(used & _LOW_SELECTIVITY))} 定位，'
+                                f'{", ".join(sorted(filtered))} 逐行检查: {detail}')
+    return problems
+
+
+def verify_query_plans(conn):
+    problems = []
+    for name, sql in planned_queries():
+        params = [None] * sql.count('?')
+        plan = [row[:2] + (row[3],) for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        reasons = _plan_problems(name, sql, plan)
+        if reasons:
+            problems.append((name, reasons))
+    return problems
+
+
+def has_statistics(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+
+
+def build_seeded_database(path, listings):
+    # 用 seed_data.py 造一个带 ANALYZE 统计信息的库，空库上的执行计划和线上数据量下的不一样
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'seed_data.py')
+    subprocess.run([sys.executable, script, path, '--force', '--listings', str(listings),
+                    '--users', str(max(100, listings // 40))], check=True, stdout=subprocess.DEVNULL)
+
+
+if __name__ == '__main__':
+    # 用法:
+    #   python migrations.py [数据库路径]        升级数据库并检查执行计划
+    #   python migrations.py --seeded 200000    在临时目录造一个 20 万本教材的库，升级后检查执行计划
+    parser = argparse.ArgumentParser(description='升级数据库 schema 并检查所有查询的执行计划')
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--seeded', type=int, metavar='LISTINGS',
+                        help='不用 path，改为用 seed_data.py 临时造一个这么多本教材的库来检查')
+    args = parser.parse_args()
+    workdir = None
+    if args.seeded:
+        workdir = tempfile.mkdtemp(prefix='textbook-plans-')
+        args.path = os.path.join(workdir, 'seeded.db')
+        build_seeded_database(args.path, args.seeded)
+    try:
+        conn = db.connect(args.path)
+        applied = migrate(conn)
+        print(f'当前 schema 版本: {current_version(conn)}，本次应用: {applied or "无"}')
+        if not has_statistics(conn):
+            print('⚠️ 数据库没有 ANALYZE 统计信息，执行计划可能和线上不同；用 --seeded 或 seed_data.py 造的库检查更可靠')
+        problems = verify_query_plans(conn)
+        conn.close()
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    for name, reasons in problems:
+        for reason in reasons:
+            print(f'❌ {name}: {reason}')
+    if problems:
+        sys.exit(1)
+    print(f'✅ {len(list(planned_queries()))} 条查询的执行计划都使用了索引，分页查询不需要额外排序')
@@ -1,106 +1,85 @@
 import json
 from http.server import HTTPServer, BaseHTTPRequestHandler
-import urllib.parse
 
-class SimpleHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+import fixtures
+import listings
+import pagination
+import repository
+import router
+
+# 不依赖数据库的演示服务，数据来自 fixtures；路由和 simple_server 共用同一套 Router
+routes = router.Router()
+store = repository.MemoryRepository()
+
+class SimpleHandler(router.RoutedHandler, BaseHTTPRequestHandler):
+    routes = routes
+    home_message = 'Backend is running!'
+
+    def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        
-        if self.path == '/':
-            response = {'message': 'Backend is running!', 'status': 'ok'}
-        elif self.path == '/api/courses/tree':
-            response = {
-                "计算机科学": {
-                    "第一学期": [
-                        {"id": 1, "name": "高等数学", "code": "MATH001"},
-                        {"id": 2, "name": "线性代数", "code": "MATH002"}
-                    ],
-                    "第二学期": [
-                        {"id": 3, "name": "数据结构", "code": "CS002"}
-                    ]
-                },
-                "通用课程": {
-                    "第一学期": [
-                        {"id": 4, "name": "大学英语", "code": "ENG001"}
-                    ]
-                }
-            }
-        elif self.path == '/api/listings':
-            response = [
-                {
-                    "id": 1,
-                    "textbook": {
-                        "title": "高等数学教材",
-                        "author": "张三",
-                        "isbn": "9787111234567"
-                    },
-                    "seller": "李四",
-                    "price": 25.0,
-                    "condition": "8成新",
-                    "description": "课本保存良好，无涂画",
-                    "created_at": "2024-01-15T10:30:00"
-                },
-                {
-                    "id": 2,
-                    "textbook": {
-                        "title": "数据结构与算法",
-                        "author": "王五",
-                        "isbn": "9787111234568"
-                    },
-                    "seller": "赵六",
-                    "price": 35.0,
-                    "condition": "9成新",
-                    "description": "几乎全新，仅翻阅过几次",
-                    "created_at": "2024-01-16T14:20:00"
-                }
-            ]
-        else:
-            response = {'error': 'Not found'}
-        
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
-    
-    def do_POST(self):
-        self.send_response(200)
+        super().end_headers()
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
         self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        
-        if self.path == '/api/search_book_by_isbn':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            isbn = data.get('isbn', '')
-            
-            response = {
-                'isbn': isbn,
-                'title': f'示例教材-{isbn[-4:] if isbn else "0000"}',
-                'author': '示例作者',
-                'publisher': '示例出版社',
-                'year': '2023'
-            }
-        elif self.path == '/api/generate_qr':
-            response = {
-                'qr_code': 'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
-            }
-        else:
-            response = {'message': 'POST endpoint created'}
-        
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
-    
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.dispatch()
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+
     def do_OPTIONS(self):
         self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
 
+    @routes.route('GET', '/')
+    def home(self):
+        self.send_json({'message': self.home_message, 'status': 'ok'})
+
+    @routes.route('GET', '/api/courses/tree')
+    def course_tree(self):
+        tree = store.catalogue().tree
+        major = self.query.get('major', [None])[0]
+        if major:
+            if major not in tree:
+                self.send_json({'error': '专业不存在'}, status=404)
+                return
+            tree = {major: tree[major]}
+        self.send_json(tree)
+
+    @routes.route('GET', '/api/listings')
+    def list_listings(self):
+        try:
+            data, headers = repository.list_listings(store, self.query)
+        except (pagination.PaginationError, listings.ListingError) as e:
+            self.send_json({'error': str(e)}, status=400)
+            return
+        self.send_json(data, headers=headers)
+
+    @routes.route('GET', '/api/listings/{listing_id:int}')
+    def get_listing(self, listing_id):
+        data = store.listing(listing_id)
+        if data is None:
+            self.send_json({'error': '教材不存在'}, status=404)
+            return
+        self.send_json(data)
+
+    @routes.route('POST', '/api/search_book_by_isbn')
+    def search_book_by_isbn(self):
+        self.send_json(fixtures.sample_book(self.request_data.get('isbn', '')))
+
+    @routes.route('POST', '/api/generate_qr')
+    def generate_qr(self):
+        self.send_json({'qr_code': fixtures.SAMPLE_QR_CODE})
+
 if __name__ == '__main__':
     server = HTTPServer(('localhost', 5000), SimpleHandler)
     print("=====================================")
@@ -110,9 +89,9 @@ if __name__ == '__main__':
     print("No external dependencies required!")
     print("Press Ctrl+C to stop")
     print("=====================================")
-    
+
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nServer stopped.")
-        server.shutdown()
\ No newline at end of file
+        server.shutdown()
@@ -0,0 +1,55 @@
+import base64
+import binascii
+import json
+import math
+
+import queries
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('limit 必须是整数')
+    if limit < 1:
+        raise PaginationError('limit 必须大于 0')
+    return min(limit, maximum)
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    # 游标对客户端是不透明的，只接受我们自己编码出去的结构
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError, binascii.Error):
+        raise PaginationError('无效的分页游标')
+    if not isinstance(values, list) or len(values) != size:
+        raise PaginationError('无效的分页游标')
+    if not all(_valid_cursor_value(value) for value in values):
+        raise PaginationError('无效的分页游标')
+    return values
+
+
+def _valid_cursor_value(value):
+    # 游标里只会有排序列的值和 id：字符串、整数或有限的浮点数
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return queries.in_integer_range(value)
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, str)
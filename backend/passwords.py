@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+# scrypt 参数：n=2**14, r=8 大约每次 50ms、16MB 内存，可以按机器性能调整
+SCRYPT_N = int(os.environ.get('TEXTBOOK_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('TEXTBOOK_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('TEXTBOOK_SCRYPT_P', '1'))
+HASH_WORKERS = int(os.environ.get('TEXTBOOK_HASH_WORKERS', str(os.cpu_count() or 2)))
+# 排队中加正在计算的任务总数上限，超过就直接拒绝，而不是让请求线程无限等待
+HASH_MAX_PENDING = int(os.environ.get('TEXTBOOK_HASH_MAX_PENDING', str(max(16, HASH_WORKERS * 4))))
+HASH_TIMEOUT = 10.0
+
+PREFIX = 'scrypt$'
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2), dklen=32)
+
+
+def compute_hash(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, n, r, p)
+    return f'{PREFIX}{n}${r}${p}${_b64(salt)}${_b64(digest)}'
+
+
+def check_hash(password, stored):
+    try:
+        n, r, p, salt, digest = stored[len(PREFIX):].split('$')
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def is_legacy(stored):
+    # 早期注册的用户密码是明文存储的
+    return not stored.startswith(PREFIX)
+
+
+def needs_upgrade(stored):
+    if is_legacy(stored):
+        return True
+    n, r, p = stored[len(PREFIX):].split('$')[:3]
+    return (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class PasswordHasher:
+    # KDF 计算放到独立进程里，不占用 HTTP worker 线程的 GIL
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING):
+        self.workers = workers
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _submit(self, func, *args):
+        if not self._pending.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            with self._lock:
+                if self._executor is None:
+                    # 用 spawn 而不是 fork，子进程不会继承监听 socket 和 SQLite 连接
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda f: self._pending.release())
+        try:
+            return future.result(timeout=HASH_TIMEOUT)
+        except FutureTimeout:
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self._submit(compute_hash, password)
+
+    def verify(self, password, stored):
+        if is_legacy(stored):
+            return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        return self._submit(check_hash, password, stored)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
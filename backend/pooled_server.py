@@ -0,0 +1,260 @@
+import json
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_MAX_WORKERS = int(os.environ.get('TEXTBOOK_MAX_WORKERS', '16'))
+# 所有 worker 都忙时最多再排队这么多连接，超出的直接回 503
+DEFAULT_MAX_QUEUED = int(os.environ.get('TEXTBOOK_MAX_QUEUED', '64'))
+# 长连接空闲时不占 worker，放在 selector 里等下一个请求；超过这个秒数没有新请求就关闭
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get('TEXTBOOK_KEEPALIVE_TIMEOUT', '5'))
+# 同时挂在 selector 里的空闲连接上限，超过后新空闲的连接直接关闭
+DEFAULT_MAX_IDLE = int(os.environ.get('TEXTBOOK_MAX_IDLE_CONNECTIONS', '1000'))
+
+_OVERLOAD_BODY = json.dumps({'success': False, 'message': '服务器繁忙，请稍后再试'},
+                            ensure_ascii=False).encode('utf-8')
+OVERLOAD_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Content-Type: application/json; charset=utf-8\r\n'
+    b'Content-Length: ' + str(len(_OVERLOAD_BODY)).encode('ascii') + b'\r\n'
+    b'Retry-After: 1\r\n'
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'Connection: close\r\n'
+    b'\r\n' + _OVERLOAD_BODY
+)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    # 配合 PooledHTTPServer 使用的长连接处理类。worker 每次只处理已经到达的请求，
+    # 处理完连接还要保持时把 socket 交回服务器的 selector，等有新数据再提交给线程池；
+    # 处理对象跟着连接走，读缓冲区里没处理完的数据不会丢
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def resume(self):
+        # 返回 True 表示连接保持，可以放回 selector 等下一个请求
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.has_buffered_request():
+            self.handle_one_request()
+        return not self.close_connection
+
+    def has_buffered_request(self):
+        # 流水线请求可能已经被读进缓冲区，selector 看不到，要在这里接着处理
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+
+class PooledHTTPServer(HTTPServer):
+    # 每个连接交给固定大小的线程池处理；排队的连接数有上限，
+    # 超过上限时在 accept 线程上直接回 503，不让请求在队列里无限等待。
+    # 处理类是 KeepAliveHandler 时，空闲的长连接由一个 selector 线程看着，不占 worker
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers=DEFAULT_MAX_WORKERS,
+                 max_queued=DEFAULT_MAX_QUEUED, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_idle=DEFAULT_MAX_IDLE):
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.rejected_connections = 0
+        self.idle_closed_connections = 0
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='http-worker')
+        # worker 交回来的空闲连接先放进 _parked，由 selector 线程自己注册；
+        # selector 和 _idle_count 只在这个线程里改
+        self._parked = []
+        self._parked_lock = threading.Lock()
+        self._idle_count = 0
+        self._closing = False
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._idle_thread = threading.Thread(target=self._watch_idle, name='http-idle', daemon=True)
+        self._idle_thread.start()
+        super().__init__(server_address, handler_class)
+
+    def _admit(self):
+        with self._pending_lock:
+            if self._pending >= self.max_workers + self.max_queued:
+                self.rejected_connections += 1
+                return False
+            self._pending += 1
+            return True
+
+    def process_request(self, request, client_address):
+        if not self._admit():
+            self.reject_request(request)
+            return
+        self._submit(request, client_address, None)
+
+    def _submit(self, request, client_address, handler):
+        try:
+            self._executor.submit(self._process_in_worker, request, client_address, handler)
+        except BaseException:
+            self._release()
+            self._close(request, handler)
+            raise
+
+    def reject_request(self, request):
+        try:
+            # 先把已经到达的请求数据读掉，避免 close 时发 RST 把 503 冲掉
+            request.setblocking(False)
+            try:
+                request.recv(65536)
+            except OSError:
+                pass
+            request.settimeout(1)
+            request.sendall(OVERLOAD_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开连接很常见，不值得打印整段 traceback
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def _release(self):
+        with self._pending_lock:
+            self._pending -= 1
+
+    def _process_in_worker(self, request, client_address, handler):
+        keep = False
+        try:
+            if handler is None:
+                handler = self.RequestHandlerClass(request, client_address, self)
+            if isinstance(handler, KeepAliveHandler):
+                keep = handler.resume()
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self._release()
+            if keep:
+                self._park(request, client_address, handler)
+            else:
+                self._close(request, handler)
+
+    def _close(self, request, handler):
+        self._finish_handler(handler)
+        self.shutdown_request(request)
+
+    def _finish_handler(self, handler):
+        if isinstance(handler, KeepAliveHandler):
+            try:
+                handler.finish()
+            except OSError:
+                pass
+
+    def _park(self, request, client_address, handler):
+        with self._parked_lock:
+            if not self._closing:
+                self._parked.append((request, client_address, handler))
+                request = None
+        if request is not None:
+            self._close(request, handler)
+            return
+        try:
+            self._wakeup_writer.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # 唤醒管道已经满了，说明 selector 线程本来就会醒
+            pass
+
+    def _watch_idle(self):
+        selector = self._selector
+        next_sweep = time.monotonic() + self.idle_timeout
+        while not self._closing:
+            timeout = max(0.0, next_sweep - time.monotonic())
+            for key, _ in selector.select(timeout):
+                if key.fileobj is self._wakeup_reader:
+                    self._register_parked()
+                    continue
+                selector.unregister(key.fileobj)
+                self._idle_count -= 1
+                request, client_address, handler, _ = key.data
+                # 有新请求到了，和新连接一样受排队上限约束
+                if self._admit():
+                    self._submit(request, client_address, handler)
+                else:
+                    self._finish_handler(handler)
+                    self.reject_request(request)
+            now = time.monotonic()
+            if now >= next_sweep:
+                self._close_expired(now)
+                next_sweep = now + min(1.0, self.idle_timeout)
+        self._close_all_idle()
+
+    def _register_parked(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        with self._parked_lock:
+            parked, self._parked = self._parked, []
+        deadline = time.monotonic() + self.idle_timeout
+        for request, client_address, handler in parked:
+            if self._idle_count >= self.max_idle:
+                self._close(request, handler)
+                continue
+            try:
+                self._selector.register(request, selectors.EVENT_READ,
+                                        (request, client_address, handler, deadline))
+            except (ValueError, OSError):
+                # 客户端在交回之前已经把连接关了
+                self._close(request, handler)
+                continue
+            self._idle_count += 1
+
+    def _close_expired(self, now):
+        expired = [key for key in self._selector.get_map().values()
+                   if key.data is not None and key.data[3] <= now]
+        for key in expired:
+            self._selector.unregister(key.fileobj)
+            self._idle_count -= 1
+            self.idle_closed_connections += 1
+            request, _, handler, _ = key.data
+            self._close(request, handler)
+
+    def _close_all_idle(self):
+        self._register_parked()
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self._selector.unregister(key.fileobj)
+                self._close(key.data[0], key.data[2])
+        self._idle_count = 0
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def server_close(self):
+        super().server_close()
+        with self._parked_lock:
+            self._closing = True
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass
+        self._idle_thread.join()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# qrcode 和 Pillow 是可选依赖：没装时服务器照常启动，只有生成二维码的接口返回错误
+try:
+    import qrcode
+except ImportError:
+    qrcode = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FORMATS = {'svg': 'image/svg+xml', 'png': 'image/png'}
+SIZES = (128, 256, 512)
+DEFAULT_SIZE = 256
+MAX_TEXT_LENGTH = 1000
+QR_CACHE_SIZE = int(os.environ.get('TEXTBOOK_QR_CACHE_SIZE', '256'))
+# 只记内容不记图片，比图片缓存大得多；图片被挤出后按内容重新生成
+MAX_SOURCES = QR_CACHE_SIZE * 16
+RENDER_WORKERS = 2
+RENDER_TIMEOUT = 5.0
+# 内容哈希决定图片，同一个 URL 的内容永远不变
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class QRError(ValueError):
+    pass
+
+
+class QRUnavailable(Exception):
+    pass
+
+
+def content_key(text, fmt, size):
+    return hashlib.blake2b(f'{fmt}:{size}:{text}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _matrix(text):
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    code.add_data(text)
+    try:
+        code.make(fit=True)
+    except (ValueError, qrcode.exceptions.DataOverflowError):
+        # 自动选版本时超出容量，有的 qrcode 版本抛 ValueError 而不是 DataOverflowError
+        raise QRError('二维码内容过长')
+    return code.get_matrix()
+
+
+def render_svg(matrix, size):
+    # 每行连续的黑色模块合并成一段路径，比逐个 rect 小得多
+    parts = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                parts.append(f'M{start} {y}h{x - start}v1h{start - x}z')
+            else:
+                x += 1
+    n = len(matrix)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+            f'viewBox="0 0 {n} {n}" shape-rendering="crispEdges">'
+            f'<rect width="{n}" height="{n}" fill="#fff"/>'
+            f'<path d="{"".join(parts)}" fill="#000"/></svg>').encode('utf-8')
+
+
+def render_png(matrix, size):
+    if Image is None:
+        raise QRUnavailable('Pillow')
+    n = len(matrix)
+    modules = Image.new('1', (n, n), 1)
+    modules.putdata([0 if cell else 1 for row in matrix for cell in row])
+    # 按整数倍放大保证模块边缘清晰，剩下的空白居中补齐到要求的尺寸
+    scale = max(1, size // n)
+    scaled = modules.resize((n * scale, n * scale), Image.NEAREST)
+    canvas = Image.new('1', (max(size, n * scale),) * 2, 1)
+    offset = (canvas.width - scaled.width) // 2
+    canvas.paste(scaled, (offset, offset))
+    buffer = io.BytesIO()
+    canvas.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def render(text, fmt, size):
+    if qrcode is None:
+        raise QRUnavailable('qrcode')
+    matrix = _matrix(text)
+    if fmt == 'png':
+        return render_png(matrix, size)
+    return render_svg(matrix, size)
+
+
+def parse_options(text, fmt, size):
+    text = str(text or '')
+    if not text:
+        raise QRError('请提供二维码内容')
+    if len(text) > MAX_TEXT_LENGTH:
+        raise QRError(f'二维码内容不能超过 {MAX_TEXT_LENGTH} 个字符')
+    fmt = (fmt or 'svg').lower()
+    if fmt not in FORMATS:
+        raise QRError('format 只支持 svg 或 png')
+    try:
+        size = int(size or DEFAULT_SIZE)
+    except (TypeError, ValueError):
+        raise QRError('size 无效')
+    if size not in SIZES:
+        raise QRError(f'size 只支持 {", ".join(map(str, SIZES))}')
+    return text, fmt, size
+
+
+class QRCache:
+    # 以内容哈希为键的 LRU；渲染放在独立线程池里，同一个键同时只渲染一次
+    def __init__(self, max_entries=QR_CACHE_SIZE, workers=RENDER_WORKERS):
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='qr-render')
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+        self._sources = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.renders = 0
+
+    def generate(self, text, fmt, size):
+        # 返回 (内容哈希, 图片字节)
+        key = content_key(text, fmt, size)
+        with self._lock:
+            self._sources[key] = (text, fmt, size)
+            self._sources.move_to_end(key)
+            while len(self._sources) > MAX_SOURCES:
+                self._sources.popitem(last=False)
+        return key, self._get(key, text, fmt, size)
+
+    def lookup(self, key):
+        # 按哈希取图片；内容没见过时返回 None
+        with self._lock:
+            source = self._sources.get(key)
+        if source is None:
+            return None
+        return source[1], self._get(key, *source)
+
+    def _get(self, key, text, fmt, size):
+        with self._lock:
+            body = self._images.get(key)
+            if body is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return body
+            future = self._inflight.get(key)
+            if future is None:
+                self.renders += 1
+                future = self._pool.submit(self._render, key, text, fmt, size)
+                self._inflight[key] = future
+        try:
+            return future.result(timeout=RENDER_TIMEOUT)
+        except FutureTimeout:
+            raise QRUnavailable('timeout')
+
+    def _render(self, key, text, fmt, size):
+        try:
+            body = render(text, fmt, size)
+            with self._lock:
+                self._images[key] = body
+                while len(self._images) > self.max_entries:
+                    self._images.popitem(last=False)
+            return body
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._images), 'hits': self.hits, 'renders': self.renders}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
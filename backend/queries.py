@@ -0,0 +1,297 @@
+# 服务器执行的全部 SQL 都放在这里，migrations.verify_query_plans 会逐条检查执行计划
+
+# 本来就要读全表的查询，不做索引检查
+FULL_SCANS = {'CATALOGUE_TREE', 'EXPORT_LISTINGS', 'EXPORT_ARCHIVED_LISTINGS', 'LISTING_FACETS'}
+# 按相关度排序的查询：相关度没有索引，只能对候选集排序，不做分页查询的排序检查
+RANKED_QUERIES = {'SEARCH_LISTINGS'}
+
+# SQLite 整数是 64 位有符号数，超出范围的 int 绑定参数时会抛 OverflowError；
+# 来自请求的整数（路径参数、筛选条件、游标、version）绑定前都要先检查
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+
+def in_integer_range(value):
+    return MIN_INTEGER <= value <= MAX_INTEGER
+
+
+# 排序方式 -> (排序列, 方向, 排序列在查询结果里的下标)；翻页游标记的是 [排序列的值, id]
+LISTING_SORTS = {
+    'newest': ('created_at', 'DESC', 9),
+    'price_asc': ('price', 'ASC', 6),
+    'price_desc': ('price', 'DESC', 6),
+}
+
+# 可以多选的筛选条件，每个都有 (is_sold, 列, created_at DESC, id DESC) 和 (is_sold, 列, price, id) 两条复合索引
+LISTING_FILTERS = ('condition', 'publisher', 'course_id')
+# 同时按多个条件筛选时，按这个顺序挑第一个作为走索引的条件，其余逐行检查（列名前加 + 不让规划器改用它们的索引）；
+# 越靠前的取值越分散
+_DRIVING_FILTERS = ('course_id', 'publisher', 'condition')
+
+
+def filtered_listings(filters, sort='newest', after=None, limit=20):
+    # 在售教材的一页；filters 里是 LISTING_FILTERS 的取值列表以及 min_price / max_price，
+    # after 是上一页最后一行的 (排序列的值, id)。返回 (sql, 参数)。
+    # 价格区间只能配合按价格排序（listings.parse_filters 负责拒绝或改写），否则没有索引能同时满足区间和排序。
+    # 走索引的条件选了多个值时拆成每个值一段、各自按索引顺序取 limit 行再合并，不用对整个结果集排序
+    column, direction, _ = LISTING_SORTS[sort]
+    has_range = filters.get('min_price') is not None or filters.get('max_price') is not None
+    if has_range and column != 'price':
+        raise ValueError('价格区间只能按价格排序')
+    driving = next((name for name in _DRIVING_FILTERS if filters.get(name)), None)
+    conditions = ['is_sold = FALSE']
+    params = []
+    for name in LISTING_FILTERS:
+        values = filters.get(name)
+        if values and name != driving:
+            conditions.append(f'+{name} IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+    if filters.get('min_price') is not None:
+        conditions.append('price >= ?')
+        params.append(filters['min_price'])
+    if filters.get('max_price') is not None:
+        conditions.append('price <= ?')
+        params.append(filters['max_price'])
+    if after is not None:
+        conditions.append(f'({column}, id) {"<" if direction == "DESC" else ">"} (?, ?)')
+        params.extend(after)
+    order = f'ORDER BY {column} {direction}, id {direction}'
+    if driving is None:
+        return _listing_select(conditions, order), params + [limit]
+    values = filters[driving]
+    conditions.insert(1, f'{driving} = ?')
+    if len(values) == 1:
+        return _listing_select(conditions, order), [values[0]] + params + [limit]
+    arms = ' UNION ALL '.join(f'SELECT * FROM ({_listing_select(conditions, order)})' for _ in values)
+    sql = f'{arms} {order} LIMIT ?'
+    arm_params = []
+    for value in values:
+        arm_params += [value] + params + [limit]
+    return sql, arm_params + [limit]
+
+
+def _listing_select(conditions, order):
+    return f'''
+    SELECT id, title, author, isbn, publisher, seller_name, price,
+           condition, description, created_at
+    FROM listings
+    WHERE {' AND '.join(conditions)}
+    {order}
+    LIMIT ?
+'''
+
+
+# 历史记录可以按哪一列查，每列都有 (列, archived_at DESC, id DESC) 索引
+ARCHIVE_LOOKUPS = ('isbn', 'seller_id')
+
+
+def archived_listings(by, after=None):
+    # 归档教材按归档时间倒序的一页；调用方依次追加查询值（after 时再加上一页最后一行的
+    # archived_at 和 id）和 LIMIT
+    if by not in ARCHIVE_LOOKUPS:
+        raise ValueError(by)
+    keyset = ' AND (archived_at, id) < (?, ?)' if after is not None else ''
+    sql = f'''
+    SELECT id, title, author, isbn, publisher, seller_name, price,
+           condition, description, created_at, is_sold, archived_at
+    FROM listings_archive
+    WHERE {by} = ?{keyset}
+    ORDER BY archived_at DESC, id DESC
+    LIMIT ?
+'''
+    return sql, list(after or ())
+
+
+# bm25 权重依次对应 title, author, publisher, description
+# 单字或常见词能匹配上万本书，每页都给全部匹配行算 bm25 再排序会随匹配数线性变慢。
+# 先按 rowid 倒序取最新的若干条匹配（参数 search.MAX_CANDIDATES），只在这些候选里按相关度排序翻页
+SEARCH_LISTINGS = '''
+    SELECT l.id, l.title, l.author, l.isbn, l.publisher, l.seller_name, l.price,
+           l.condition, l.description, l.created_at
+    FROM (
+        SELECT rowid, bm25(listings_fts, 10.0, 4.0, 2.0, 1.0) AS score
+        FROM listings_fts
+        WHERE listings_fts MATCH ?
+        ORDER BY rowid DESC
+        LIMIT ?
+    ) AS hits
+    JOIN listings AS l ON l.id = hits.rowid
+    ORDER BY hits.score, hits.rowid DESC
+    LIMIT ? OFFSET ?
+'''
+
+# 按主键顺序遍历整张表，不需要排序；先导出在售表，再导出归档表
+EXPORT_LISTINGS = '''
+    SELECT id, title, author, isbn, publisher, seller_id, seller_name, price,
+           condition, description, contact_method, contact_info, created_at, is_sold, NULL
+    FROM listings
+    ORDER BY id
+'''
+
+EXPORT_ARCHIVED_LISTINGS = '''
+    SELECT id, title, author, isbn, publisher, seller_id, seller_name, price,
+           condition, description, contact_method, contact_info, created_at, is_sold, archived_at
+    FROM listings_archive
+    ORDER BY id
+'''
+
+# 单本教材的详情；锁定、售出等条件更新没有命中时也用它判断原因
+LISTING_BY_ID = '''
+    SELECT id, title, author, isbn, publisher, seller_name, price,
+           condition, description, created_at, seller_id, version, is_sold,
+           reserved_by, CASE WHEN reserved_until > datetime('now') THEN reserved_until END
+    FROM listings
+    WHERE id = ?
+'''
+
+# 下面四条都是单条语句的条件更新：version 对不上或状态不允许时 rowcount 为 0，不需要先读再写。
+# 同一个买家重复预订只是延长预订时间
+RESERVE_LISTING = '''
+    UPDATE listings
+    SET reserved_by = ?, reserved_until = datetime('now', ?), version = version + 1
+    WHERE id = ? AND version = ? AND is_sold = FALSE AND seller_id != ?
+      AND (reserved_until IS NULL OR reserved_until <= datetime('now') OR reserved_by = ?)
+'''
+
+MARK_LISTING_SOLD = '''
+    UPDATE listings
+    SET is_sold = TRUE, version = version + 1
+    WHERE id = ? AND version = ? AND seller_id = ? AND is_sold = FALSE
+'''
+
+# 参数为 NULL 的列保持原值
+UPDATE_LISTING = '''
+    UPDATE listings
+    SET price = COALESCE(?, price), condition = COALESCE(?, condition),
+        description = COALESCE(?, description), description_tokens = COALESCE(?, description_tokens),
+        contact_method = COALESCE(?, contact_method),
+        contact_info = COALESCE(?, contact_info), version = version + 1
+    WHERE id = ? AND version = ? AND seller_id = ? AND is_sold = FALSE
+'''
+
+# 下架直接删除，全文索引和分面计数由删除触发器同步
+WITHDRAW_LISTING = '''
+    DELETE FROM listings
+    WHERE id = ? AND version = ? AND seller_id = ? AND is_sold = FALSE
+'''
+
+# 归档任务每批挑出的 id，分售出和过期两种
+SOLD_LISTING_IDS = '''
+    SELECT id FROM listings
+    WHERE is_sold = TRUE
+    LIMIT ?
+'''
+
+EXPIRED_LISTING_IDS = '''
+    SELECT id FROM listings
+    WHERE is_sold = FALSE AND created_at < ?
+    LIMIT ?
+'''
+
+# 参数是 id 的 JSON 数组，和下面的 DELETE 在同一个事务里执行
+ARCHIVE_LISTINGS = '''
+    INSERT INTO listings_archive (id, title, author, isbn, publisher, seller_id, seller_name, price,
+                                  condition, description, contact_method, contact_info, course_id,
+                                  created_at, is_sold)
+    SELECT id, title, author, isbn, publisher, seller_id, seller_name, price,
+           condition, description, contact_method, contact_info, course_id, created_at, is_sold
+    FROM listings
+    WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+DELETE_LISTINGS_BY_IDS = '''
+    DELETE FROM listings WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+INSERT_USER = '''
+    INSERT INTO users (username, email, password, major, grade, student_id, phone)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# 用户名和邮箱可能分别命中两个不同的用户，所以逐个校验密码
+LOGIN_CANDIDATES = '''
+    SELECT id, username, email, major, grade, password
+    FROM users
+    WHERE username = ? OR email = ?
+'''
+
+# 只在密码没被并发修改过时才升级哈希
+UPGRADE_PASSWORD = '''
+    UPDATE users SET password = ? WHERE id = ? AND password = ?
+'''
+
+INSERT_SESSION = '''
+    INSERT INTO sessions (user_id, session_token, expires_at)
+    VALUES (?, ?, ?)
+'''
+
+SESSION_BY_TOKEN = '''
+    SELECT s.user_id, u.username, s.expires_at
+    FROM sessions AS s
+    JOIN users AS u ON u.id = s.user_id
+    WHERE s.session_token = ? AND s.expires_at > datetime('now')
+'''
+
+DELETE_SESSION = '''
+    DELETE FROM sessions WHERE session_token = ?
+'''
+
+DELETE_EXPIRED_SESSIONS = '''
+    DELETE FROM sessions
+    WHERE id IN (
+        SELECT id FROM sessions
+        WHERE expires_at <= datetime('now')
+        LIMIT ?
+    )
+'''
+
+INSERT_LISTING = '''
+    INSERT INTO listings (title, author, isbn, publisher, seller_id, seller_name,
+                          price, condition, description, contact_method, contact_info, course_id,
+                          title_tokens, author_tokens, publisher_tokens, description_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# seed_data.py 造数据用，发布时间和是否售出都由调用方给出
+INSERT_SEEDED_LISTING = '''
+    INSERT INTO listings (title, author, isbn, publisher, seller_id, seller_name, price, condition,
+                          description, contact_method, contact_info, course_id, created_at, is_sold,
+                          title_tokens, author_tokens, publisher_tokens, description_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# listing_facets 的行数只取决于各分面有多少种取值，和教材总数无关，所以整表读出
+LISTING_FACETS = '''
+    SELECT f.facet, f.value, f.count, c.name
+    FROM listing_facets AS f
+    LEFT JOIN courses AS c ON f.facet = 'course_id' AND c.id = CAST(f.value AS INTEGER)
+    WHERE f.count > 0
+    ORDER BY f.facet, f.count DESC, f.value
+'''
+
+ISBN_METADATA_BY_ISBN = '''
+    SELECT found, title, author, publisher, year
+    FROM isbn_metadata
+    WHERE isbn = ? AND expires_at > datetime('now')
+'''
+
+UPSERT_ISBN_METADATA = '''
+    INSERT OR REPLACE INTO isbn_metadata (isbn, found, title, author, publisher, year, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+LISTINGS_VERSION = '''
+    SELECT version FROM listings_meta WHERE id = 1
+'''
+
+CATALOGUE_VERSION = '''
+    SELECT version FROM catalogue_meta WHERE id = 1
+'''
+
+CATALOGUE_TREE = '''
+    SELECT m.name, s.name, c.id, c.name, c.code
+    FROM courses AS c
+    JOIN majors AS m ON m.id = c.major_id
+    JOIN semesters AS s ON s.id = c.semester_id
+    ORDER BY m.sort_order, m.id, s.sort_order, s.id, c.sort_order, c.id
+'''
@@ -0,0 +1,165 @@
+import os
+import urllib.parse
+
+import catalogue
+import db
+import fixtures
+import listings
+import pagination
+import queries
+
+# 路由通过这里读课程和在售教材，不直接拼 SQL。SQLiteRepository 是正式的数据源；
+# MemoryRepository 返回 fixtures 里的演示数据，两个演示服务用它。压测时也可以让 simple_server
+# 换成内存仓库（TEXTBOOK_REPOSITORY=memory），把 HTTP 层的开销和数据库的开销分开测；
+# 这个模式下其余读写教材的接口回 503，注册、登录仍然用 SQLite
+REPOSITORY = os.environ.get('TEXTBOOK_REPOSITORY', 'sqlite')
+
+# listing_to_dict 接受的列顺序，和 queries 里列表查询的前十列一致
+LISTING_FIELDS = ('id', 'title', 'author', 'isbn', 'publisher', 'seller_name', 'price',
+                  'condition', 'description', 'created_at')
+
+
+def listing_to_dict(listing):
+    return {
+        "id": listing[0],
+        "textbook": {
+            "title": listing[1],
+            "author": listing[2] or "未知作者",
+            "isbn": listing[3] or "无ISBN"
+        },
+        "seller": listing[5] or "匿名用户",
+        "price": listing[6],
+        "condition": listing[7],
+        "description": listing[8] or "无描述",
+        "created_at": listing[9]
+    }
+
+
+class Repository:
+    # False 表示数据不在 SQLite 里，服务器上其他直接查 SQLite 的教材接口和它对不上
+    backed_by_database = True
+
+    def catalogue(self):
+        # 返回 catalogue.CatalogueSnapshot，课程树连同编码好的响应一起缓存
+        raise NotImplementedError
+
+    def listings_page(self, filters, sort, after, limit):
+        # 参数含义同 queries.filtered_listings；返回 (教材列表, 下一页的 after)，没有下一页时 after 为 None
+        raise NotImplementedError
+
+    def listing(self, listing_id):
+        # 单本在售教材的详情，带 version 和状态；不存在时返回 None
+        raise NotImplementedError
+
+
+class SQLiteRepository(Repository):
+    def __init__(self, connection=db.get_connection):
+        self._connection = connection
+        self._catalogue = catalogue.CourseCatalogue()
+
+    def catalogue(self):
+        return self._catalogue.snapshot(self._connection())
+
+    def listings_page(self, filters, sort, after, limit):
+        # 多取一行用来判断是否还有下一页
+        sql, params = queries.filtered_listings(filters, sort, after, limit + 1)
+        rows = self._connection().execute(sql, params).fetchall()
+        if len(rows) <= limit:
+            return [listing_to_dict(row) for row in rows], None
+        rows = rows[:limit]
+        return [listing_to_dict(row) for row in rows], [rows[-1][queries.LISTING_SORTS[sort][2]], rows[-1][0]]
+
+    def listing(self, listing_id):
+        row = self._connection().execute(queries.LISTING_BY_ID, (listing_id,)).fetchone()
+        if row is None:
+            return None
+        data = listing_to_dict(row)
+        data['seller_id'] = row[10]
+        data['version'] = row[11]
+        data['status'] = 'sold' if row[12] else 'reserved' if row[14] else 'available'
+        # 预订过期或已售出后 reserved_by 不再有意义
+        data['reserved_by'] = row[13] if data['status'] == 'reserved' else None
+        data['reserved_until'] = None if row[12] else row[14]
+        return data
+
+
+class MemoryRepository(Repository):
+    backed_by_database = False
+
+    def __init__(self, records=fixtures.LISTINGS, course_tree=fixtures.COURSE_TREE):
+        self._records = [dict(record) for record in records]
+        self._by_id = {record['id']: record for record in self._records}
+        self._snapshot = catalogue.CatalogueSnapshot(0, course_tree)
+
+    def catalogue(self):
+        return self._snapshot
+
+    def listings_page(self, filters, sort, after, limit):
+        # 按和 SQL 相同的规则在内存里筛选、排序、翻页
+        column, direction, _ = queries.LISTING_SORTS[sort]
+        descending = direction == 'DESC'
+        rows = [record for record in self._records if _matches(record, filters)]
+        rows.sort(key=lambda record: (record[column], record['id']), reverse=descending)
+        if after is not None:
+            after = tuple(after)
+            try:
+                rows = [record for record in rows
+                        if ((record[column], record['id']) < after) == descending
+                        and (record[column], record['id']) != after]
+            except TypeError:
+                raise pagination.PaginationError('无效的分页游标')
+        page = [listing_to_dict([record[field] for field in LISTING_FIELDS]) for record in rows[:limit]]
+        if len(rows) <= limit:
+            return page, None
+        last = rows[limit - 1]
+        return page, [last[column], last['id']]
+
+    def listing(self, listing_id):
+        record = self._by_id.get(listing_id)
+        if record is None:
+            return None
+        data = listing_to_dict([record[field] for field in LISTING_FIELDS])
+        data.update({'seller_id': record['seller_id'], 'version': 0, 'status': 'available',
+                     'reserved_by': None, 'reserved_until': None})
+        return data
+
+
+def _matches(record, filters):
+    for name in queries.LISTING_FILTERS:
+        values = filters.get(name)
+        if values and record.get(name) not in values:
+            return False
+    if filters.get('min_price') is not None and record['price'] < filters['min_price']:
+        return False
+    if filters.get('max_price') is not None and record['price'] > filters['max_price']:
+        return False
+    return True
+
+
+def list_listings(repository, query):
+    # GET /api/listings 的处理逻辑，几个服务共用；query 是 parse_qs 的结果，返回 (响应数据, 响应头)。
+    # 参数不合法时抛 pagination.PaginationError 或 listings.ListingError
+    limit = pagination.parse_limit(query.get('limit', [None])[0])
+    filters, sort = listings.parse_filters(query)
+    cursor_param = query.get('cursor', [None])[0]
+    after = pagination.decode_cursor(cursor_param, 2) if cursor_param else None
+    page, next_after = repository.listings_page(filters, sort, after, limit)
+
+    headers = {}
+    if next_after is not None:
+        next_cursor = pagination.encode_cursor(next_after)
+        headers['X-Next-Cursor'] = next_cursor
+        # 下一页链接保留原来的筛选和排序参数
+        params = [(name, value) for name, values in sorted(query.items())
+                  if name not in ('limit', 'cursor') for value in values]
+        params += [('limit', limit), ('cursor', next_cursor)]
+        headers['Link'] = f'</api/listings?{urllib.parse.urlencode(params)}>; rel="next"'
+    return page, headers
+
+
+def from_env():
+    if REPOSITORY == 'memory':
+        return MemoryRepository()
+    if REPOSITORY != 'sqlite':
+        raise ValueError(f'TEXTBOOK_REPOSITORY 只支持 sqlite 或 memory，当前为 {REPOSITORY}')
+    return SQLiteRepository()
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'headers', 'gzip_body'],
+                            defaults=(None,))
+
+
+class ResponseCache:
+    # 缓存编码好的响应字节。写操作调用 invalidate() 让代数加一，旧代数的条目全部作废；
+    # 别的进程写入的数据由 sync() 按数据库里的版本号发现
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, generation, body, headers=None, gzip_body=None):
+        entry = CachedResponse(body, make_etag(body), dict(headers or {}), gzip_body)
+        with self._lock:
+            # 查询期间如果有写入，这份结果可能已经过期，只返回不缓存
+            if generation != self._generation:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def sync(self, data_version):
+        # data_version 是触发器维护的版本号，和上次看到的不同就说明数据被改过
+        if data_version == self._data_version:
+            return
+        with self._lock:
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._generation += 1
+                self._entries.clear()
+
+    def record_not_modified(self, entry):
+        # 304 没有响应体，省下的就是这份缓存的字节数
+        with self._lock:
+            self.not_modified += 1
+            self.bytes_saved += len(entry.body)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'generation': self._generation,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'not_modified': self.not_modified,
+                'bytes_saved': self.bytes_saved,
+            }
+
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def gzip_etag(etag):
+    # 同一份数据压缩前后是两串不同的字节，强 ETag 不能共用，压缩版加上后缀
+    return etag[:-1] + '-gzip"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate == etag:
+            return True
+    return False
@@ -0,0 +1,171 @@
+import json
+import urllib.parse
+from collections import namedtuple
+
+import queries
+
+# 三个后端共用的路由表。不带参数的路径直接按 (方法, 路径) 查字典；
+# 带 {参数} 的路径按段建一棵前缀树，查找次数只和路径段数有关，和路由数量无关。
+# {id:int} 只匹配数字并转成 int，{name} 匹配任意非空的一段
+
+Match = namedtuple('Match', ['handler', 'params', 'route'])
+
+CONVERTERS = {'int': int, 'str': str}
+
+
+class RouteNotFound(LookupError):
+    pass
+
+
+class MethodNotAllowed(LookupError):
+    def __init__(self, allowed):
+        super().__init__(', '.join(allowed))
+        self.allowed = allowed
+
+
+class _Node:
+    __slots__ = ('children', 'param', 'handlers', 'route')
+
+    def __init__(self):
+        self.children = {}
+        # (参数名, 转换函数, 子节点)
+        self.param = None
+        # 方法 -> (处理函数, 固定参数)
+        self.handlers = {}
+        self.route = None
+
+
+def _split(path):
+    return [urllib.parse.unquote(part) for part in path.strip('/').split('/')] if path.strip('/') else []
+
+
+def _convert(converter, value):
+    if converter is int:
+        # isdigit() 对 '²' 这类字符也返回 True，int() 却不接受；超出 SQLite 整数范围的也当作不匹配
+        if not (value.isascii() and value.isdigit()):
+            return None
+        number = int(value)
+        return number if queries.in_integer_range(number) else None
+    return value or None
+
+
+class Router:
+    def __init__(self):
+        self._static = {}
+        self._static_routes = {}
+        self._root = _Node()
+
+    def add(self, method, template, handler, **defaults):
+        # defaults 会和路径参数一起传给处理函数，几条路由共用一个处理函数时用来区分
+        if '{' not in template:
+            self._static[(method, template)] = (handler, defaults)
+            self._static_routes.setdefault(template, {})[method] = handler
+            return
+        node = self._root
+        labels = []
+        for part in _split(template):
+            if part.startswith('{') and part.endswith('}'):
+                name, _, kind = part[1:-1].partition(':')
+                converter = CONVERTERS[kind or 'str']
+                if node.param is None:
+                    node.param = (name, converter, _Node())
+                elif node.param[:2] != (name, converter):
+                    raise ValueError(f'{template} 和已有路由的参数冲突')
+                node = node.param[2]
+                labels.append('{' + name + '}')
+            else:
+                node = node.children.setdefault(part, _Node())
+                labels.append(part)
+        node.handlers[method] = (handler, defaults)
+        # 指标和日志里用的路由名，不带类型标注
+        node.route = '/' + '/'.join(labels)
+
+    def route(self, method, template, **defaults):
+        def register(handler):
+            self.add(method, template, handler, **defaults)
+            return handler
+        return register
+
+    def _find(self, path):
+        node = self._root
+        params = {}
+        for part in _split(path):
+            child = node.children.get(part)
+            if child is None:
+                if node.param is None:
+                    return None, None
+                name, converter, child = node.param
+                value = _convert(converter, part)
+                if value is None:
+                    return None, None
+                params[name] = value
+            node = child
+        return (node, params) if node.handlers else (None, None)
+
+    def match(self, method, path):
+        # path 不带查询串；找不到路径抛 RouteNotFound，路径存在但方法不对抛 MethodNotAllowed
+        found = self._static.get((method, path))
+        if found is not None:
+            return Match(found[0], dict(found[1]), path)
+        methods = self._static_routes.get(path)
+        if methods is not None:
+            raise MethodNotAllowed(sorted(methods))
+        node, params = self._find(path)
+        if node is None:
+            raise RouteNotFound(path)
+        found = node.handlers.get(method)
+        if found is None:
+            raise MethodNotAllowed(sorted(node.handlers))
+        params.update(found[1])
+        return Match(found[0], params, node.route)
+
+    def route_name(self, path):
+        # 给指标分组用：匹配到的路由模板，匹配不到时返回 None
+        if path in self._static_routes:
+            return path
+        node, _ = self._find(path)
+        return node.route if node is not None else None
+
+
+class RoutedHandler:
+    # 给 BaseHTTPRequestHandler 用的混入类：按 routes 分发，处理函数以 (self, **路径参数) 调用。
+    # 子类提供 send_json；需要限制请求体大小等时覆盖 read_body
+    routes = None
+    query = None
+    body = b''
+    request_data = None
+
+    def dispatch(self):
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            match = self.routes.match(self.command, url.path)
+        except RouteNotFound:
+            self.send_unrouted(404, 'Not found')
+            return
+        except MethodNotAllowed as e:
+            self.send_unrouted(405, 'Method not allowed', {'Allow': ', '.join(e.allowed + ['OPTIONS'])})
+            return
+        self.query = urllib.parse.parse_qs(url.query)
+        if self.command != 'GET' and not self.read_body():
+            return
+        match.handler(self, **match.params)
+
+    def read_body(self):
+        # 返回 False 表示已经直接回复了客户端
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        self.body = self.rfile.read(length) if length > 0 else b''
+        try:
+            data = json.loads(self.body.decode('utf-8')) if self.body else {}
+        except ValueError:
+            data = {}
+        # 批量接口直接使用 self.body，其余接口只接受 JSON 对象
+        self.request_data = data if isinstance(data, dict) else {}
+        return True
+
+    def send_unrouted(self, status, message, headers=None):
+        headers = dict(headers or {})
+        if self.headers.get('Content-Length', '0') not in ('', '0') or self.headers.get('Transfer-Encoding'):
+            # 请求体没有读，不能继续复用这条连接
+            headers['Connection'] = 'close'
+            self.close_connection = True
+        self.send_json({'error': message}, status=status, headers=headers)
@@ -0,0 +1,51 @@
+import re
+
+# FTS5 自带的 unicode61 分词器会把一整串汉字当成一个词，"数学" 就搜不到 "高等数学"。
+# 所以写入索引前先把汉字拆成相邻二元组（高等 等数 数学），字母数字按词保留。
+# 单字搜索靠二元组前缀只能找到以这个字开头的词（"学" 搜不到 "高等数学"），
+# 所以每个汉字也单独索引一次；单字放在所有二元组之后，不打断多字短语的相邻位置。
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_CJK_RUN = re.compile(f'[{_CJK}]+')
+_RUN = re.compile(f'[{_CJK}]+|[^\\W_{_CJK}]+')
+# 参与全文检索的列；分词结果由应用写入 listings 的 <列>_tokens，触发器再同步到 listings_fts
+TOKEN_COLUMNS = ('title', 'author', 'publisher', 'description')
+# 只在最新发布的这么多条匹配里按相关度排序，搜索结果最多翻到这里
+MAX_CANDIDATES = 500
+
+
+def _run_tokens(run):
+    if _CJK_RUN.fullmatch(run):
+        if len(run) == 1:
+            return [run]
+        return [run[i:i + 2] for i in range(len(run) - 1)]
+    return [run.lower()]
+
+
+def bigram_text(text):
+    if not text:
+        return ''
+    tokens = []
+    chars = []
+    for run in _RUN.findall(text):
+        tokens.extend(_run_tokens(run))
+        if len(run) > 1 and _CJK_RUN.fullmatch(run):
+            chars.extend(run)
+    return ' '.join(tokens + chars)
+
+
+def match_expression(query):
+    # 每一段连续文字变成一个短语，各段之间是 AND；
+    # 汉字（单字和多字短语）精确匹配，字母数字词用前缀匹配
+    terms = []
+    for run in _RUN.findall(query or ''):
+        phrase = '"' + ' '.join(_run_tokens(run)) + '"'
+        if _CJK_RUN.fullmatch(run):
+            terms.append(phrase)
+        else:
+            terms.append(phrase + '*')
+    return ' AND '.join(terms)
+
+
+def register_functions(conn):
+    # 迁移 3、11、12 在 SQL 里用 cjk_bigrams 给已有的行分词，跑迁移的连接要注册；触发器里已经不再调用
+    conn.create_function('cjk_bigrams', 1, bigram_text, deterministic=True)
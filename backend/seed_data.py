@@ -0,0 +1,258 @@
+import argparse
+import bisect
+import functools
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import db
+import migrations
+import passwords
+import queries
+import search
+
+# 用法:
+#   python seed_data.py scale.db --users 100000 --listings 2000000
+#   python seed_data.py scale.db --users 1000 --listings 20000 --sold-ratio 0.5 --seed 7
+# 生成一个全新的数据库用于容量测试；目标文件已存在时需要 --force，不会动仓库里的 textbook_exchange.db。
+# 所有账号的密码都是 SEED_PASSWORD。同样的参数和 --seed 生成的数据完全一样。
+
+SEED_PASSWORD = 'password123'
+BATCH_SIZE = 50000
+LISTING_INDEXES = ('idx_listings_feed', 'idx_listings_isbn', 'idx_listings_seller', 'idx_listings_condition',
+                   'idx_listings_publisher', 'idx_listings_course', 'idx_listings_price',
+                   *migrations.PRICE_FILTER_INDEXES)
+
+SUBJECTS = ['高等数学', '线性代数', '概率论与数理统计', '离散数学', '数据结构', '操作系统', '计算机网络',
+            '计算机组成原理', '编译原理', '数据库系统概论', '软件工程', '大学物理', '大学化学', '有机化学',
+            '电路分析基础', '模拟电子技术', '数字电子技术', '信号与系统', '自动控制原理', '理论力学',
+            '材料力学', '工程制图', '微观经济学', '宏观经济学', '会计学原理', '管理学', '市场营销学',
+            '大学英语', '英语听说教程', '马克思主义基本原理概论', '毛泽东思想和中国特色社会主义理论体系概论',
+            '中国近现代史纲要', '思想道德与法治', '大学语文', '心理学导论', '法理学', '民法学']
+SUFFIXES = ['', '（第二版）', '（第三版）', '（第四版）', '（第五版）', '（第七版）', '上册', '下册',
+            '学习指导', '习题全解', '实验教程']
+AUTHORS = ['同济大学数学系', '严蔚敏', '谭浩强', '汤小丹', '谢希仁', '唐朔飞', '王珊', '马工程编写组',
+           '高鸿业', '张三', '李华', '王建国', '陈明', '刘芳', '赵伟', '孙丽']
+PUBLISHERS = {'高等教育出版社': '04', '清华大学出版社': '302', '机械工业出版社': '111',
+              '人民邮电出版社': '115', '电子工业出版社': '121', '科学出版社': '03',
+              '北京大学出版社': '301', '上海外语教育出版社': '5446'}
+CONDITIONS = [('全新', 0.08), ('9成新', 0.3), ('8成新', 0.37), ('7成新', 0.18), ('6成新', 0.07)]
+DISCOUNT = {'全新': 0.7, '9成新': 0.55, '8成新': 0.45, '7成新': 0.35, '6成新': 0.25}
+DESCRIPTIONS = ['课本保存良好，无涂画', '几乎全新，仅翻阅过几次', '有少量笔记，不影响阅读', '附赠课后习题答案',
+                '重点已用荧光笔标出', '封面有折痕，内页干净', '图书馆旁当面交易', '可小刀', '毕业清书，打包更便宜', '']
+CONTACT_METHODS = [('wechat', 0.6), ('qq', 0.25), ('phone', 0.15)]
+MAJORS = ['计算机科学', '软件工程', '电子信息工程', '自动化', '机械工程', '土木工程', '经济学', '会计学',
+          '工商管理', '法学', '英语', '汉语言文学', '数学与应用数学', '物理学', '化学']
+GRADES = ['大一', '大二', '大三', '大四', '研一', '研二', '研三']
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢'
+GIVEN = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红娥玲芬燕彬鹏辉思雨欣宇轩浩然子涵梓萱一诺'
+
+
+def isbn13(prefix):
+    body = prefix[:12]
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def book_catalogue(rng, count, course_ids):
+    # 每本书固定一个 ISBN；按出版社前缀编号，保证 ISBN 合法且互不重复。
+    # 大约七成的书关联到课程目录里的某门课，其余不填课程
+    books = []
+    for i in range(count):
+        publisher = rng.choice(list(PUBLISHERS))
+        code = PUBLISHERS[publisher]
+        serial = str(i).zfill(8 - len(code))
+        title = rng.choice(SUBJECTS) + rng.choice(SUFFIXES)
+        list_price = round(rng.uniform(25, 89), 1)
+        course_id = rng.choice(course_ids) if course_ids and rng.random() < 0.7 else None
+        books.append((title, rng.choice(AUTHORS), isbn13('9787' + code + serial), publisher, list_price, course_id))
+    return books
+
+
+def zipf_cum_weights(count, exponent):
+    # 排名越靠前的书被挂出的次数越多：少数公共课教材占了大部分挂单
+    total = 0.0
+    cumulative = []
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def weighted(pairs):
+    # 返回一个按权重抽样的函数，累计权重只算一次
+    values = [value for value, _ in pairs]
+    cumulative = list(itertools.accumulate(weight for _, weight in pairs))
+    total = cumulative[-1]
+    return lambda rng: values[bisect.bisect_left(cumulative, rng.random() * total)]
+
+
+def person_name(rng):
+    return rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN) for _ in range(rng.choice((1, 2))))
+
+
+def generate_users(rng, count, password_hash, names):
+    for i in range(count):
+        yield (f'stu{i + 1:07d}', f'stu{i + 1:07d}@campus.edu.cn', password_hash, rng.choice(MAJORS),
+               rng.choice(GRADES), f'20{rng.randint(18, 25)}{rng.randint(0, 999999):06d}',
+               f'1{rng.choice("3456789")}{rng.randint(0, 999999999):09d}')
+
+
+def generate_listings(rng, count, users, names, books, exponent, sold_ratio, days):
+    cumulative = zipf_cum_weights(len(books), exponent)
+    total_weight = cumulative[-1]
+    pick_condition = weighted(CONDITIONS)
+    pick_method = weighted(CONTACT_METHODS)
+    # 书名、作者、出版社、描述都来自有限的词表，分词结果缓存起来，省掉大部分 Python 调用
+    tokens = functools.lru_cache(maxsize=None)(search.bigram_text)
+    end = time.time()
+    span = days * 86400
+    for i in range(count):
+        book = books[bisect.bisect_left(cumulative, rng.random() * total_weight)]
+        title, author, isbn, publisher, list_price, course_id = book
+        condition = pick_condition(rng)
+        # 发布时间随 id 递增，和线上按时间倒序的翻页方式一致
+        age = 1 - (i + rng.random()) / count
+        created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(end - span * age))
+        # 越早挂出的书越可能已经卖掉，总体售出比例约等于 sold_ratio
+        is_sold = rng.random() < min(0.98, sold_ratio * 2 * age)
+        price = round(list_price * DISCOUNT[condition] * rng.uniform(0.8, 1.2), 1)
+        seller = rng.randrange(users)
+        method = pick_method(rng)
+        contact = f'wx_{seller}' if method == 'wechat' else f'{rng.randint(10000000, 999999999)}'
+        description = rng.choice(DESCRIPTIONS)
+        # 已售出的书不进全文索引，也就不用存分词
+        search_tokens = (None,) * 4 if is_sold else (tokens(title), tokens(author), tokens(publisher),
+                                                      tokens(description))
+        yield (title, author, isbn, publisher, seller + 1, names[seller], price, condition,
+               description, method, contact, course_id, created_at, is_sold, *search_tokens)
+
+
+def generate_sessions(rng, count, users):
+    now = datetime.now(timezone.utc)
+    for _ in range(count):
+        # 约三成已经过期，留给 SessionSweeper 清理
+        offset = timedelta(hours=rng.uniform(-72, 24 * 7)) if rng.random() < 0.7 else timedelta(hours=-rng.uniform(1, 240))
+        yield (rng.randrange(users) + 1, '%032x' % rng.getrandbits(128),
+               (now + offset).strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def insert_batched(conn, sql, rows, batch_size):
+    inserted = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return inserted
+        conn.executemany(sql, batch)
+        inserted += len(batch)
+
+
+def seed(conn, args):
+    rng = random.Random(args.seed)
+    timings = {}
+    names = [person_name(rng) for _ in range(args.users)]
+    password_hash = passwords.compute_hash(SEED_PASSWORD)
+
+    started = time.perf_counter()
+    with conn:
+        insert_batched(conn, queries.INSERT_USER, generate_users(rng, args.users, password_hash, names),
+                       args.batch_size)
+    timings['users'] = time.perf_counter() - started
+
+    # 大批量写入时先去掉二级索引以及全文索引、分面计数和版本号的触发器，写完再由迁移函数重建，比逐行维护快得多
+    started = time.perf_counter()
+    with conn:
+        for index in LISTING_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {index}')
+        for trigger in ('listings_fts_insert', 'listing_facets_insert', 'listings_insert_bump_version'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        course_ids = [row[0] for row in conn.execute('SELECT id FROM courses ORDER BY id')]
+        books = book_catalogue(rng, args.books, course_ids)
+        insert_batched(conn, queries.INSERT_SEEDED_LISTING,
+                       generate_listings(rng, args.listings, args.users, names, books,
+                                         args.zipf, args.sold_ratio, args.days),
+                       args.batch_size)
+    timings['listings'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with conn:
+        migrations.add_secondary_indexes(conn)
+    timings['indexes'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with conn:
+        # 重建筛选用的复合索引和触发器，并按 GROUP BY 重新统计分面计数
+        migrations.add_listing_facets(conn)
+        migrations.add_price_filter_indexes(conn)
+        migrations.create_listings_version_triggers(conn)
+    timings['facets'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with conn:
+        if args.no_search_index:
+            # 只恢复触发器，之后新发布的书照常进索引
+            migrations.create_listings_fts_triggers(conn)
+        else:
+            # 重新建触发器，并把在售的书写进 listings_fts
+            migrations.create_listings_fts_triggers(conn)
+            migrations.fill_listings_fts(conn)
+    timings['fts'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with conn:
+        insert_batched(conn, queries.INSERT_SESSION, generate_sessions(rng, args.sessions, args.users),
+                       args.batch_size)
+        conn.execute('ANALYZE')
+    timings['sessions'] = time.perf_counter() - started
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成用于容量测试的教材交易数据库')
+    parser.add_argument('path', help='输出的数据库文件')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--listings', type=int, default=200000)
+    parser.add_argument('--sessions', type=int, default=None, help='默认为用户数的一半')
+    parser.add_argument('--books', type=int, default=None, help='不同 ISBN 的数量，默认为挂单数的 1%%，至少 200')
+    parser.add_argument('--zipf', type=float, default=1.1, help='ISBN 热度的 Zipf 指数，越大越集中')
+    parser.add_argument('--sold-ratio', type=float, default=0.35)
+    parser.add_argument('--days', type=int, default=365, help='发布时间分布在最近多少天内')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--force', action='store_true', help='目标文件已存在时先删除')
+    parser.add_argument('--no-search-index', action='store_true',
+                        help='不给生成的教材建全文索引（两百万行时能省一分多钟），搜索只能搜到之后新发布的书')
+    args = parser.parse_args()
+    if args.sessions is None:
+        args.sessions = args.users // 2
+    if args.books is None:
+        args.books = max(200, args.listings // 100)
+    if args.users < 1:
+        parser.error('--users 至少为 1')
+
+    if os.path.exists(args.path):
+        if not args.force:
+            print(f'❌ {args.path} 已存在，加 --force 覆盖', file=sys.stderr)
+            sys.exit(1)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    started = time.perf_counter()
+    conn = db.connect(args.path)
+    # 新建的一次性数据库，断电丢了重新生成即可
+    conn.execute('PRAGMA synchronous = OFF')
+    migrations.migrate(conn)
+    timings = seed(conn, args)
+    conn.close()
+
+    details = '，'.join(f'{name} {seconds:.1f}s' for name, seconds in timings.items())
+    print(f'✅ {args.path}: {args.users} 个用户，{args.listings} 本教材，{args.sessions} 个会话，'
+          f'用时 {time.perf_counter() - started:.1f} 秒（{details}）')
+
+
+if __name__ == '__main__':
+    main()
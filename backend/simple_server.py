@@ -1,283 +1,806 @@
 
 try:
-    from http.server import HTTPServer, BaseHTTPRequestHandler
+    import functools
     import json
     import urllib.parse
+    import uuid
     import sqlite3
     import os
+    import hmac
+    import base64
+    import time
     from datetime import datetime
+    from pooled_server import PooledHTTPServer, KeepAliveHandler, DEFAULT_MAX_WORKERS
+    import db
+    import pagination
+    import migrations
+    import queries
+    import search
+    import response_cache
+    import compression
+    import export
+    import auth
+    import passwords
+    import admission
+    import listings
+    import write_queue
+    import isbn
+    import qr
+    import metrics
+    import access_log
+    import archive
+    import repository
+    import router
+    from repository import listing_to_dict
     
     def init_database():
-        conn = sqlite3.connect('textbook_exchange.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                major TEXT,
-                grade TEXT,
-                student_id TEXT,
-                phone TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS listings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                author TEXT,
-                isbn TEXT,
-                publisher TEXT,
-                seller_id INTEGER,
-                seller_name TEXT,
-                price REAL NOT NULL,
-                condition TEXT,
-                description TEXT,
-                contact_method TEXT,
-                contact_info TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_sold BOOLEAN DEFAULT FALSE,
-                FOREIGN KEY (seller_id) REFERENCES users (id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                session_token TEXT UNIQUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        migrations.migrate(db.get_connection())
     
-    class Handler(BaseHTTPRequestHandler):
+    listing_cache = response_cache.ResponseCache()
+    # 课程树、教材列表和详情从这里读；TEXTBOOK_REPOSITORY=memory 时换成演示数据，压测用
+    store = repository.from_env()
+    session_cache = auth.SessionCache()
+    password_hasher = passwords.PasswordHasher()
+    admission_control = admission.AdmissionController()
+    # 注册、登录、发布的单行写入交给写线程合并提交
+    writer = write_queue.WriteQueue()
+    isbn_lookup = isbn.IsbnLookup(isbn.provider_from_env(), writer.execute)
+    qr_cache = qr.QRCache()
+    request_log = access_log.AccessLog()
+    # 售出和过期的教材定期移到归档表，移动后清掉列表缓存
+    compactor = archive.Compactor(listing_cache)
+    
+    # 导出接口只对持有管理员令牌的请求开放；没有配置令牌时导出关闭
+    ADMIN_TOKEN = os.environ.get('TEXTBOOK_ADMIN_TOKEN', '')
+    
+    MAX_BODY_SIZE = 8 * 1024 * 1024
+    
+    # 买家预订后保留多久，过期后其他人可以重新预订
+    RESERVATION_MINUTES = int(os.environ.get('TEXTBOOK_RESERVATION_MINUTES', '30'))
+    LISTING_ACTION_MESSAGES = {'reserve': '预订成功', 'sold': '已标记为售出', 'update': '修改成功', 'withdraw': '已下架'}
+    
+    KEEPALIVE_TIMEOUT = float(os.environ.get('TEXTBOOK_KEEPALIVE_TIMEOUT', '5'))
+    KEEPALIVE_MAX_REQUESTS = int(os.environ.get('TEXTBOOK_KEEPALIVE_MAX_REQUESTS', '100'))
+    
+    routes = router.Router()
+    
+    def database_only(handler):
+        # TEXTBOOK_REPOSITORY=memory 时只有课程树、列表和详情来自内存仓库；搜索、分面、历史、导出和
+        # 发布、预订等写操作用的是 SQLite 里的另一份数据，结果对不上，直接回 503
+        @functools.wraps(handler)
+        def wrapper(self, **params):
+            if not store.backed_by_database:
+                self.send_json({'success': False, 'message': f'{repository.REPOSITORY} 仓库模式下不支持这个接口'},
+                               status=503)
+                return
+            handler(self, **params)
+        return wrapper
+    
+    def route_label(path):
+        # /metrics 按路由模板分组；匹配不到的路径统一记为 other，避免标签数量随扫描请求无限增长
+        return routes.route_name(path.split('?', 1)[0]) or 'other'
+    
+    class Handler(router.RoutedHandler, KeepAliveHandler):
+        routes = routes
+        # HTTP/1.1 默认保持连接；空闲的连接由 PooledHTTPServer 放进 selector 等待，不占 worker，
+        # 空闲超过 KEEPALIVE_TIMEOUT 秒后关闭。timeout 只限制请求开始到达后读完它最多等多久
+        protocol_version = 'HTTP/1.1'
+        timeout = KEEPALIVE_TIMEOUT
+        # 头和响应体是分两次写的，长连接上 Nagle 会和延迟 ACK 叠加出约 40ms 的等待
+        disable_nagle_algorithm = True
+        requests_on_connection = 0
+        started_at = None
+        status_code = None
+        bytes_sent = 0
+        # 处理函数往这里放要写进访问日志的额外字段，比如登录用户和发布结果
+        log_fields = None
+        
         def log_message(self, format, *args):
             pass
+        
+        def log_error(self, format, *args):
+            # 请求发到一半超时只是关掉了连接，记成 timeout，让 error 里只剩真正的错误
+            event = 'timeout' if format.startswith('Request timed out') else 'error'
+            request_log.log({'ts': access_log.timestamp(), 'event': event,
+                             'client': self.client_address[0], 'message': format % args})
+        
+        def parse_request(self):
+            if not super().parse_request():
+                return False
+            # 从请求头解析完开始计时，长连接上等待下一个请求的空闲时间不算在内
+            self.started_at = time.perf_counter()
+            self.status_code = None
+            self.bytes_sent = 0
+            self.log_fields = None
+            metrics.request_started()
+            return True
+        
+        def handle_one_request(self):
+            self.started_at = None
+            error = None
+            try:
+                super().handle_one_request()
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                if self.started_at is not None:
+                    self.record_request(error)
+        
+        def record_request(self, error):
+            elapsed = time.perf_counter() - self.started_at
+            length = self.headers.get('Content-Length', '')
+            bytes_in = int(length) if length.isdigit() else 0
+            route = route_label(self.path)
+            metrics.request_finished(route, self.command, self.status_code or 0, elapsed,
+                                     bytes_in, self.bytes_sent)
+            entry = {
+                'ts': access_log.timestamp(),
+                'event': 'access',
+                'client': self.client_address[0],
+                'method': self.command,
+                'path': self.path,
+                'route': route,
+                'status': self.status_code or 0,
+                'duration_ms': round(elapsed * 1000, 3),
+                'bytes_in': bytes_in,
+                'bytes_out': self.bytes_sent,
+                'user_agent': self.headers.get('User-Agent', ''),
+            }
+            if self.log_fields:
+                entry.update(self.log_fields)
+            if error is not None:
+                entry['error'] = repr(error)
+            request_log.log(entry)
+        
+        def send_response(self, code, message=None):
+            self.status_code = code
+            super().send_response(code, message)
             
         def end_headers(self):
+            self.requests_on_connection += 1
+            if self.requests_on_connection >= KEEPALIVE_MAX_REQUESTS:
+                self.send_header('Connection', 'close')
+            elif not self.close_connection:
+                self.send_header('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT:g}, max={KEEPALIVE_MAX_REQUESTS}')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+            self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match, Authorization')
+            self.send_header('Access-Control-Expose-Headers', 'X-Next-Cursor, Link, ETag')
             super().end_headers()
         
         def do_OPTIONS(self):
             self.send_response(200)
+            self.send_header('Content-Length', '0')
             self.end_headers()
         
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        def send_body(self, body, status=200, headers=None,
+                      content_type='application/json; charset=utf-8', compress=True):
+            if compress and len(body) >= compression.GZIP_MIN_SIZE:
+                headers = dict(headers or {})
+                headers['Vary'] = 'Accept-Encoding'
+                if compression.accepts_gzip(self.headers.get('Accept-Encoding')):
+                    compressed = compression.maybe_compress(body)
+                    if compressed is not None:
+                        body = compressed
+                        headers['Content-Encoding'] = 'gzip'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
             self.end_headers()
-            
-            if self.path == '/':
-                data = {'message': 'Backend running!', 'status': 'ok'}
-            elif self.path == '/api/courses/tree':
-                data = {
-                    "计算机科学": {
-                        "第一学期": [
-                            {"id": 1, "name": "高等数学", "code": "MATH001"},
-                            {"id": 2, "name": "线性代数", "code": "MATH002"}
-                        ],
-                        "第二学期": [
-                            {"id": 3, "name": "数据结构", "code": "CS002"}
-                        ]
-                    },
-                    "通用课程": {
-                        "第一学期": [
-                            {"id": 4, "name": "大学英语", "code": "ENG001"}
-                        ]
-                    }
-                }
-            elif self.path == '/api/listings':
-                conn = sqlite3.connect('textbook_exchange.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT id, title, author, isbn, publisher, seller_name, price, 
-                           condition, description, created_at 
-                    FROM listings 
-                    WHERE is_sold = FALSE 
-                    ORDER BY created_at DESC
-                ''')
-                listings = cursor.fetchall()
-                conn.close()
-                
-                data = []
-                for listing in listings:
-                    data.append({
-                        "id": listing[0],
-                        "textbook": {
-                            "title": listing[1],
-                            "author": listing[2] or "未知作者",
-                            "isbn": listing[3] or "无ISBN"
-                        },
-                        "seller": listing[5] or "匿名用户",
-                        "price": listing[6],
-                        "condition": listing[7],
-                        "description": listing[8] or "无描述",
-                        "created_at": listing[9]
-                    })
+            self.wfile.write(body)
+            self.bytes_sent += len(body)
+        
+        def send_json(self, data, status=200, headers=None):
+            self.send_body(json.dumps(data, ensure_ascii=False).encode('utf-8'), status, headers)
+        
+        def send_cached(self, key, build):
+            # 别的进程写库后 listings_meta.version 会变；内存仓库的数据不在库里，不用查，也不该多一次 SQLite 往返
+            if store.backed_by_database:
+                listing_cache.sync(db.get_connection().execute(queries.LISTINGS_VERSION).fetchone()[0])
+            entry = listing_cache.get(key)
+            if entry is None:
+                generation = listing_cache.generation
+                try:
+                    data, headers = build()
+                except (pagination.PaginationError, listings.ListingError) as e:
+                    self.send_json({'error': str(e)}, status=400)
+                    return
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                # 压缩结果跟着缓存条目一起存，热点响应只压缩一次
+                entry = listing_cache.put(key, generation, body, headers,
+                                          compression.maybe_compress(body))
+            self.send_entry(entry, listing_cache)
+        
+        def send_entry(self, entry, cache=None, content_type='application/json; charset=utf-8'):
+            # 先按 Accept-Encoding 选定发哪种编码，再用这种编码自己的 ETag 做 If-None-Match 校验
+            use_gzip = entry.gzip_body is not None and compression.accepts_gzip(self.headers.get('Accept-Encoding'))
+            headers = dict(entry.headers)
+            headers['ETag'] = response_cache.gzip_etag(entry.etag) if use_gzip else entry.etag
+            # no-cache 让浏览器每次都带 If-None-Match 来校验，数据没变就只回 304
+            headers.setdefault('Cache-Control', 'no-cache')
+            if entry.gzip_body is not None:
+                headers['Vary'] = 'Accept-Encoding'
+            if response_cache.etag_matches(self.headers.get('If-None-Match'), headers['ETag']):
+                if cache is not None:
+                    cache.record_not_modified(entry)
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+            if use_gzip:
+                headers['Content-Encoding'] = 'gzip'
+                self.send_body(entry.gzip_body, headers=headers, content_type=content_type, compress=False)
             else:
-                data = {'error': 'Not found'}
-            
-            self.wfile.write(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+                self.send_body(entry.body, headers=headers, content_type=content_type, compress=False)
         
-        def do_POST(self):
+        def send_chunked(self, chunks, content_type):
             self.send_response(200)
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Type', content_type)
+            if self.request_version == 'HTTP/1.0':
+                # HTTP/1.0 不支持分块编码，写完直接关闭连接
+                self.close_connection = True
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+                    self.bytes_sent += len(chunk)
+                return
+            self.send_header('Transfer-Encoding', 'chunked')
             self.end_headers()
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    self.bytes_sent += len(chunk)
+            self.wfile.write(b'0\r\n\r\n')
+        
+        def is_admin(self):
+            auth = self.headers.get('Authorization', '')
+            if not ADMIN_TOKEN or not auth.startswith('Bearer '):
+                return False
+            return hmac.compare_digest(auth[len('Bearer '):].strip(), ADMIN_TOKEN)
+        
+        def export_listings(self, query):
+            if not self.is_admin():
+                self.send_json({'error': '需要管理员令牌'}, status=403)
+                return
+            fmt = query.get('format', ['ndjson'])[0]
+            if fmt not in export.FORMATS:
+                self.send_json({'error': '导出格式只支持 ndjson 或 json'}, status=400)
+                return
+            content_type, encode = export.FORMATS[fmt]
+            batches = export.iter_batches(db.get_connection())
+            self.send_chunked(encode(batches), content_type)
+        
+        def send_busy(self, message='服务器繁忙，请稍后再试', status=503, retry_after=1):
+            self.send_json({'success': False, 'message': message}, status=status,
+                           headers={'Retry-After': str(retry_after)})
+        
+        def rate_limit_key(self):
+            # 登录用户各自一个令牌桶；令牌无效或没登录时按客户端地址
+            session = session_cache.lookup(auth.bearer_token(self.headers))
+            if session is not None:
+                return f'user:{session.user_id}'
+            return admission.client_address(self.client_address[0], self.headers.get('X-Forwarded-For'))
+        
+        def admitted(self, handler):
+            route = urllib.parse.urlsplit(self.path).path
+            client = self.rate_limit_key() if admission_control.buckets is not None else None
+            try:
+                ticket = admission_control.admit(route, client)
+            except admission.Rejected as e:
+                # 被拒绝的 POST 请求体没有读，不能继续复用这条连接
+                message = '请求过于频繁，请稍后再试' if e.status == 429 else '服务器繁忙，请稍后再试'
+                self.send_json({'success': False, 'message': message}, status=e.status,
+                               headers={'Retry-After': str(e.retry_after), 'Connection': 'close'})
+                return
+            with ticket:
+                handler()
+        
+        def authenticate(self, login, password):
+            conn = db.get_connection()
+            for row in conn.execute(queries.LOGIN_CANDIDATES, (login, login)).fetchall():
+                stored = row[5]
+                if not password_hasher.verify(password, stored):
+                    continue
+                if passwords.needs_upgrade(stored):
+                    # 明文或旧参数的密码在登录成功时顺便升级成当前的 scrypt 哈希
+                    with conn:
+                        conn.execute(queries.UPGRADE_PASSWORD,
+                                     (password_hasher.hash(password), row[0], stored))
+                return row[:5]
+            return None
+        
+        def publish_batch(self, session, body):
+            try:
+                records = listings.parse_batch_body(body, self.headers.get('Content-Type'))
+            except (ValueError, listings.ListingError) as e:
+                message = str(e) if isinstance(e, listings.ListingError) else '请求体必须是 JSON 数组或 NDJSON'
+                self.send_json({'success': False, 'message': message}, status=400)
+                return
+            if len(records) > listings.MAX_BATCH_SIZE:
+                self.send_json({'success': False,
+                                'message': f'单次最多发布 {listings.MAX_BATCH_SIZE} 本'}, status=413)
+                return
             
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                post_data = self.rfile.read(content_length)
-                try:
-                    request_data = json.loads(post_data.decode('utf-8'))
-                except:
-                    request_data = {}
+            params, errors = listings.validate_batch(records, session.user_id, session.username)
+            inserted = 0
+            if params:
+                conn = db.get_connection()
+                # 所有合法的行在同一个事务里 executemany，只提交一次
+                with conn:
+                    inserted = listings.insert_many(conn, params)
+                listing_cache.invalidate()
+            self.log_fields = {'user_id': session.user_id, 'inserted': inserted, 'rejected': len(errors)}
+            self.send_json({
+                'success': not errors,
+                'message': f'成功发布 {inserted} 本，失败 {len(errors)} 本',
+                'inserted': inserted,
+                'errors': errors
+            })
+        
+        def lookup_isbn(self, raw):
+            try:
+                isbn13, metadata = isbn_lookup.lookup(db.get_connection(), raw)
+            except isbn.InvalidISBN:
+                self.send_json({'success': False, 'message': 'ISBN 格式不正确'}, status=400)
+                return
+            except isbn.LookupPending:
+                # 上游查询还在后台进行，结果会写进缓存，稍后重试即可命中
+                self.send_busy('教材信息查询中，请稍后重试')
+                return
+            except isbn.ProviderError:
+                self.send_json({'success': False, 'message': '教材信息服务暂不可用'}, status=502)
+                return
+            if metadata is None:
+                self.send_json({'success': False, 'message': '未找到该ISBN对应的教材', 'isbn': isbn13},
+                               status=404)
+                return
+            data = {'isbn': isbn13}
+            data.update(metadata)
+            self.send_json(data)
+        
+        def generate_qr(self, request_data):
+            try:
+                text, fmt, size = qr.parse_options(request_data.get('text'), request_data.get('format'),
+                                                   request_data.get('size'))
+                key, body = qr_cache.generate(text, fmt, size)
+            except qr.QRError as e:
+                self.send_json({'success': False, 'message': str(e)}, status=400)
+                return
+            except qr.QRUnavailable:
+                self.send_busy('二维码生成服务不可用，请确认服务器已安装 qrcode 和 Pillow')
+                return
+            # url 可以被浏览器长期缓存；qr_code 保留原来的 data URL 写法
+            self.send_json({
+                'url': f'/api/qr/{key}.{fmt}',
+                'format': fmt,
+                'size': size,
+                'qr_code': f'data:{qr.FORMATS[fmt]};base64,' + base64.b64encode(body).decode('ascii'),
+            })
+        
+        def send_qr(self, name):
+            key, _, fmt = name.partition('.')
+            try:
+                found = qr_cache.lookup(key)
+            except (qr.QRError, qr.QRUnavailable):
+                found = None
+            if found is None or found[0] != fmt:
+                self.send_json({'error': 'Not found'}, status=404)
+                return
+            # SVG 可以压缩，和缓存的响应一样由 send_entry 按编码选 ETag
+            gzip_body = compression.maybe_compress(found[1]) if fmt == 'svg' else None
+            entry = response_cache.CachedResponse(found[1], f'"{key}"', {'Cache-Control': qr.IMMUTABLE}, gzip_body)
+            self.send_entry(entry, content_type=qr.FORMATS[fmt])
+        
+        def send_metrics(self):
+            body = metrics.render((
+                ('textbook_rejected_connections_total', 'Connections answered with 503 before reaching a worker.',
+                 self.server.rejected_connections),
+                ('textbook_idle_closed_connections_total', 'Keep-alive connections closed after the idle timeout.',
+                 self.server.idle_closed_connections),
+                ('textbook_group_commit_batches_total', 'Transactions committed by the write queue.', writer.batches),
+                ('textbook_group_commit_writes_total', 'Statements committed by the write queue.', writer.writes),
+                ('textbook_access_log_dropped_total', 'Access log entries dropped because the buffer was full.',
+                 request_log.dropped),
+                ('textbook_archived_listings_total', 'Sold or expired listings moved to the archive table.',
+                 compactor.archived),
+            ))
+            self.send_body(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+        
+        def send_course_tree(self, major):
+            snapshot = store.catalogue()
+            if major:
+                entry = snapshot.majors.get(major)
+                if entry is None:
+                    self.send_json({'error': '专业不存在'}, status=404)
+                    return
             else:
-                request_data = {}
+                entry = snapshot.full
+            self.send_entry(entry)
+        
+        def list_facets(self):
+            # listing_facets 由触发器维护，这里只读几十行汇总，不扫 listings
+            facets = {}
+            for facet, value, count, course_name in db.get_connection().execute(queries.LISTING_FACETS):
+                # 空字符串是没填这一项的教材，不作为可选的筛选值
+                if not value:
+                    continue
+                entry = {'value': value, 'count': count}
+                if facet == 'course_id':
+                    entry['value'] = int(value)
+                    entry['name'] = course_name or f'课程 {value}'
+                facets.setdefault(facet, []).append(entry)
+            return facets, {}
+        
+        def search_listings(self, query):
+            q = query.get('q', [''])[0].strip()
+            expression = search.match_expression(q)
+            if not expression:
+                raise pagination.PaginationError('请输入搜索关键词')
+            limit = pagination.parse_limit(query.get('limit', [None])[0])
+            cursor_param = query.get('cursor', [None])[0]
+            offset = pagination.decode_cursor(cursor_param, 1)[0] if cursor_param else 0
+            if not isinstance(offset, int) or offset < 0:
+                raise pagination.PaginationError('无效的分页游标')
             
-            if self.path == '/api/search_book_by_isbn':
-                isbn = request_data.get('isbn', '')
-                data = {
-                    'isbn': isbn,
-                    'title': f'示例教材-{isbn[-4:] if isbn else "0000"}',
-                    'author': '示例作者',
-                    'publisher': '示例出版社',
-                    'year': '2023'
-                }
-            elif self.path == '/api/generate_qr':
-                data = {'qr_code': 'data:image/svg+xml;charset=utf-8,<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100"><rect width="100" height="100" fill="white"/><text x="50" y="50" text-anchor="middle" dy=".3em" font-family="monospace" font-size="8">二维码已生成</text></svg>'}
-            elif self.path == '/api/register':
-                username = request_data.get('username', '').strip()
-                email = request_data.get('email', '').strip()
-                password = request_data.get('password', '')
-                major = request_data.get('major', '')
-                grade = request_data.get('grade', '')
-                student_id = request_data.get('student_id', '')
-                phone = request_data.get('phone', '')
-                
-                if not username or not email or not password:
-                    data = {'success': False, 'message': '请填写必要信息'}
-                else:
-                    try:
-                        conn = sqlite3.connect('textbook_exchange.db')
-                        cursor = conn.cursor()
-                        cursor.execute('''
-                            INSERT INTO users (username, email, password, major, grade, student_id, phone)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        ''', (username, email, password, major, grade, student_id, phone))
-                        conn.commit()
-                        user_id = cursor.lastrowid
-                        conn.close()
-                        data = {'success': True, 'message': '注册成功', 'user_id': user_id}
-                    except sqlite3.IntegrityError:
-                        data = {'success': False, 'message': '用户名或邮箱已存在'}
-                    except Exception as e:
-                        data = {'success': False, 'message': f'注册失败: {str(e)}'}
+            cursor = db.get_connection().cursor()
+            cursor.execute(queries.SEARCH_LISTINGS, (expression, search.MAX_CANDIDATES, limit + 1, offset))
+            listings = cursor.fetchall()
             
-            elif self.path == '/api/login':
-                username = request_data.get('username', '').strip()
-                password = request_data.get('password', '')
-                
-                if not username or not password:
-                    data = {'success': False, 'message': '请输入用户名和密码'}
-                else:
-                    conn = sqlite3.connect('textbook_exchange.db')
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT id, username, email, major, grade 
-                        FROM users 
-                        WHERE (username = ? OR email = ?) AND password = ?
-                    ''', (username, username, password))
-                    user = cursor.fetchone()
-                    
-                    if user:
-                        import uuid
-                        session_token = str(uuid.uuid4())
-                        cursor.execute('''
-                            INSERT INTO sessions (user_id, session_token, expires_at)
-                            VALUES (?, ?, datetime('now', '+7 days'))
-                        ''', (user[0], session_token))
-                        conn.commit()
-                        
-                        data = {
-                            'success': True,
-                            'message': '登录成功',
-                            'user': {
-                                'id': user[0],
-                                'username': user[1],
-                                'email': user[2],
-                                'major': user[3],
-                                'grade': user[4]
-                            },
-                            'token': session_token
-                        }
-                    else:
-                        data = {'success': False, 'message': '用户名或密码错误'}
-                    
-                    conn.close()
+            headers = {}
+            if len(listings) > limit:
+                listings = listings[:limit]
+                next_cursor = pagination.encode_cursor([offset + limit])
+                headers['X-Next-Cursor'] = next_cursor
+                headers['Link'] = (f'</api/listings/search?q={urllib.parse.quote(q)}'
+                                   f'&limit={limit}&cursor={next_cursor}>; rel="next"')
+            return [listing_to_dict(listing) for listing in listings], headers
+        
+        def list_history(self, query):
+            # 已归档（售出或过期）的教材，按 ISBN 看历史成交价，或按卖家看发布记录
+            lookups = [by for by in queries.ARCHIVE_LOOKUPS if query.get(by, [''])[0]]
+            if len(lookups) != 1:
+                raise listings.ListingError('请提供 isbn 或 seller_id 其中一个')
+            by = lookups[0]
+            value = query[by][0].strip()
+            if by == 'seller_id':
+                try:
+                    value = int(value)
+                    if not queries.in_integer_range(value):
+                        raise ValueError(value)
+                except ValueError:
+                    raise listings.ListingError('seller_id 必须是整数')
+            limit = pagination.parse_limit(query.get('limit', [None])[0])
+            cursor_param = query.get('cursor', [None])[0]
+            after = pagination.decode_cursor(cursor_param, 2) if cursor_param else None
+            sql, params = queries.archived_listings(by, after)
+            rows = db.get_connection().execute(sql, [value] + params + [limit + 1]).fetchall()
             
-            elif self.path == '/api/publish':
-                title = request_data.get('title', '').strip()
-                author = request_data.get('author', '')
-                isbn = request_data.get('isbn', '')
-                publisher = request_data.get('publisher', '')
-                price = request_data.get('price', 0)
-                condition = request_data.get('condition', '8成新')
-                description = request_data.get('description', '')
-                contact_method = request_data.get('contact_method', 'wechat')
-                contact_info = request_data.get('contact_info', '')
-                seller_name = request_data.get('seller_name', '匿名用户')
-                seller_id = request_data.get('seller_id', 1)
-                
-                if not title or not price or not contact_info:
-                    data = {'success': False, 'message': '请填写必要信息'}
+            headers = {}
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = pagination.encode_cursor([rows[-1][11], rows[-1][0]])
+                headers['X-Next-Cursor'] = next_cursor
+                headers['Link'] = (f'</api/listings/history?{by}={urllib.parse.quote(str(value))}'
+                                   f'&limit={limit}&cursor={next_cursor}>; rel="next"')
+            data = []
+            for row in rows:
+                entry = listing_to_dict(row)
+                entry['status'] = 'sold' if row[10] else 'expired'
+                entry['archived_at'] = row[11]
+                data.append(entry)
+            return data, headers
+        
+        def send_listing(self, listing_id):
+            # 详情里带着 version，预订、修改等操作要把它原样带回来；不走列表缓存，总是读最新状态
+            data = store.listing(listing_id)
+            if data is None:
+                self.send_json({'error': '教材不存在'}, status=404)
+                return
+            self.send_json(data)
+        
+        def change_listing(self, listing_id, action, request_data):
+            session = session_cache.lookup(auth.bearer_token(self.headers))
+            if session is None:
+                self.send_json({'success': False, 'message': '请先登录'}, status=401)
+                return
+            try:
+                version = listings.parse_version(request_data)
+                if action == 'reserve':
+                    sql = queries.RESERVE_LISTING
+                    params = (session.user_id, f'+{RESERVATION_MINUTES} minutes', listing_id, version,
+                              session.user_id, session.user_id)
+                elif action == 'update':
+                    sql = queries.UPDATE_LISTING
+                    params = listings.validate_changes(request_data) + (listing_id, version, session.user_id)
                 else:
-                    try:
-                        conn = sqlite3.connect('textbook_exchange.db')
-                        cursor = conn.cursor()
-                        cursor.execute('''
-                            INSERT INTO listings (title, author, isbn, publisher, seller_id, seller_name,
-                                                 price, condition, description, contact_method, contact_info)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (title, author, isbn, publisher, seller_id, seller_name, 
-                              price, condition, description, contact_method, contact_info))
-                        conn.commit()
-                        listing_id = cursor.lastrowid
-                        conn.close()
-                        data = {'success': True, 'message': '发布成功', 'listing_id': listing_id}
-                    except Exception as e:
-                        data = {'success': False, 'message': f'发布失败: {str(e)}'}
+                    sql = queries.MARK_LISTING_SOLD if action == 'sold' else queries.WITHDRAW_LISTING
+                    params = (listing_id, version, session.user_id)
+            except listings.ListingError as e:
+                self.send_json({'success': False, 'message': str(e)}, status=400)
+                return
+            
+            # 一条条件更新就决出胜负，不用先读再写，也不用在请求线程里持有写锁
+            try:
+                changed = writer.update(sql, params)
+            except write_queue.WriteQueueFull:
+                self.send_busy()
+                return
+            self.log_fields = {'user_id': session.user_id, 'listing_id': listing_id, 'action': action,
+                               'outcome': 'success' if changed else 'conflict'}
+            if changed:
+                listing_cache.invalidate()
+                data = {'success': True, 'message': LISTING_ACTION_MESSAGES[action]}
+                if action != 'withdraw':
+                    data['version'] = version + 1
+                self.send_json(data)
+                return
+            
+            # 没有命中时再读一次当前状态，告诉客户端失败的原因和最新的 version
+            listing = store.listing(listing_id)
+            if listing is None:
+                self.send_json({'success': False, 'message': '教材不存在'}, status=404)
+                return
+            own = listing['seller_id'] == session.user_id
+            if action == 'reserve' and own:
+                status, message = 403, '不能预订自己发布的教材'
+            elif action != 'reserve' and not own:
+                status, message = 403, '只能修改自己发布的教材'
+            elif listing['status'] == 'sold':
+                status, message = 409, '教材已售出'
+            elif (action == 'reserve' and listing['status'] == 'reserved'
+                  and listing['reserved_by'] != session.user_id):
+                status, message = 409, '教材已被其他同学预订'
+            else:
+                status, message = 409, '教材信息已被修改，请刷新后重试'
+            self.send_json({'success': False, 'message': message, 'listing': listing}, status=status)
+        
+        def do_GET(self):
+            self.admitted(self.dispatch)
+        
+        do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+        
+        def read_body(self):
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length > MAX_BODY_SIZE:
+                self.send_json({'success': False, 'message': '请求体过大'}, status=413,
+                               headers={'Connection': 'close'})
+                return False
+            return super().read_body()
+        
+        def cache_key(self):
+            # 参数顺序不同的同一个查询共用一个缓存条目
+            url = urllib.parse.urlsplit(self.path)
+            return url.path + '?' + urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(url.query)))
+        
+        @routes.route('GET', '/')
+        def home(self):
+            self.send_json({'message': 'Backend running!', 'status': 'ok'})
+        
+        @routes.route('GET', '/api/courses/tree')
+        def get_course_tree(self):
+            self.send_course_tree(self.query.get('major', [None])[0])
+        
+        @routes.route('GET', '/api/listings')
+        def get_listings(self):
+            self.send_cached(self.cache_key(), lambda: repository.list_listings(store, self.query))
+        
+        @routes.route('GET', '/api/listings/search')
+        @database_only
+        def get_search(self):
+            self.send_cached(self.cache_key(), lambda: self.search_listings(self.query))
+        
+        @routes.route('GET', '/api/listings/facets')
+        @database_only
+        def get_facets(self):
+            self.send_cached('/api/listings/facets', self.list_facets)
+        
+        @routes.route('GET', '/api/listings/history')
+        @database_only
+        def get_history(self):
+            self.send_cached(self.cache_key(), lambda: self.list_history(self.query))
+        
+        @routes.route('GET', '/api/listings/export')
+        @database_only
+        def get_export(self):
+            self.export_listings(self.query)
+        
+        @routes.route('GET', '/api/listings/{listing_id:int}')
+        def get_listing(self, listing_id):
+            self.send_listing(listing_id)
+        
+        @routes.route('GET', '/api/qr/{key}')
+        def get_qr(self, key):
+            self.send_qr(key)
+        
+        @routes.route('GET', '/metrics')
+        def get_metrics(self):
+            self.send_metrics()
+        
+        @routes.route('GET', '/api/cache/stats')
+        def get_cache_stats(self):
+            data = listing_cache.stats()
+            data['sessions'] = session_cache.stats()
+            data['writes'] = {'batches': writer.batches, 'writes': writer.writes}
+            data['isbn'] = isbn_lookup.stats()
+            data['qr'] = qr_cache.stats()
+            data['access_log'] = request_log.stats()
+            data['archive'] = compactor.stats()
+            self.send_json(data)
+        
+        @routes.route('POST', '/api/search_book_by_isbn')
+        def post_isbn(self):
+            self.lookup_isbn(self.request_data.get('isbn', ''))
+        
+        @routes.route('POST', '/api/generate_qr')
+        def post_qr(self):
+            self.generate_qr(self.request_data)
+        
+        @routes.route('POST', '/api/register')
+        def register(self):
+            request_data = self.request_data
+            username = request_data.get('username', '').strip()
+            email = request_data.get('email', '').strip()
+            password = request_data.get('password', '')
+            major = request_data.get('major', '')
+            grade = request_data.get('grade', '')
+            student_id = request_data.get('student_id', '')
+            phone = request_data.get('phone', '')
+            
+            if not username or not email or not password:
+                data = {'success': False, 'message': '请填写必要信息'}
             else:
-                data = {'message': 'Success', 'received': request_data}
+                try:
+                    password_hash = password_hasher.hash(password)
+                    user_id = writer.execute(queries.INSERT_USER,
+                                             (username, email, password_hash, major, grade, student_id, phone))
+                    data = {'success': True, 'message': '注册成功', 'user_id': user_id}
+                except (passwords.HashingBusy, write_queue.WriteQueueFull):
+                    self.send_busy()
+                    return
+                except sqlite3.IntegrityError:
+                    data = {'success': False, 'message': '用户名或邮箱已存在'}
+                except Exception as e:
+                    data = {'success': False, 'message': f'注册失败: {str(e)}'}
+            self.send_json(data)
+        
+        @routes.route('POST', '/api/login')
+        def login(self):
+            username = self.request_data.get('username', '').strip()
+            password = self.request_data.get('password', '')
+            
+            if not username or not password:
+                self.send_json({'success': False, 'message': '请输入用户名和密码'})
+                return
+            try:
+                user = self.authenticate(username, password)
+            except passwords.HashingBusy:
+                self.send_busy()
+                return
             
-            self.wfile.write(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+            if not user:
+                self.log_fields = {'login': username, 'outcome': 'failed'}
+                self.send_json({'success': False, 'message': '用户名或密码错误'})
+                return
+            session_token = str(uuid.uuid4())
+            expires_at = auth.new_expiry()
+            try:
+                writer.execute(queries.INSERT_SESSION, (user[0], session_token, expires_at))
+            except write_queue.WriteQueueFull:
+                self.send_busy()
+                return
+            session_cache.add(session_token, user[0], user[1], expires_at)
+            self.log_fields = {'user_id': user[0], 'login': username, 'outcome': 'success'}
+            
+            self.send_json({
+                'success': True,
+                'message': '登录成功',
+                'user': {
+                    'id': user[0],
+                    'username': user[1],
+                    'email': user[2],
+                    'major': user[3],
+                    'grade': user[4]
+                },
+                'token': session_token
+            })
+        
+        @routes.route('POST', '/api/logout')
+        def logout(self):
+            token = auth.bearer_token(self.headers)
+            if token:
+                conn = db.get_connection()
+                with conn:
+                    conn.execute(queries.DELETE_SESSION, (token,))
+                session_cache.revoke(token)
+            self.send_json({'success': True, 'message': '已退出登录'})
+        
+        @routes.route('POST', '/api/publish')
+        @database_only
+        def publish(self):
+            session = session_cache.lookup(auth.bearer_token(self.headers))
+            if session is None:
+                self.send_json({'success': False, 'message': '请先登录'}, status=401)
+                return
+            
+            # 卖家身份只认登录令牌，忽略请求体里的 seller_id / seller_name
+            try:
+                listing = listings.validate_listing(self.request_data)
+            except listings.ListingError as e:
+                self.send_json({'success': False, 'message': str(e)})
+                return
+            try:
+                listing_id = writer.execute(queries.INSERT_LISTING,
+                                            listings.insert_params(listing, session.user_id, session.username))
+                listing_cache.invalidate()
+                self.log_fields = {'user_id': session.user_id, 'listing_id': listing_id}
+                data = {'success': True, 'message': '发布成功', 'listing_id': listing_id}
+            except write_queue.WriteQueueFull:
+                self.send_busy()
+                return
+            except Exception as e:
+                data = {'success': False, 'message': f'发布失败: {str(e)}'}
+            self.send_json(data)
+        
+        @routes.route('POST', '/api/publish/batch')
+        @database_only
+        def post_batch(self):
+            session = session_cache.lookup(auth.bearer_token(self.headers))
+            if session is None:
+                self.send_json({'success': False, 'message': '请先登录'}, status=401)
+                return
+            self.publish_batch(session, self.body)
+        
+        @routes.route('POST', '/api/listings/{listing_id:int}/reserve', action='reserve')
+        @routes.route('POST', '/api/listings/{listing_id:int}/sold', action='sold')
+        @routes.route('POST', '/api/listings/{listing_id:int}/update', action='update')
+        @routes.route('POST', '/api/listings/{listing_id:int}/withdraw', action='withdraw')
+        @database_only
+        def post_listing_action(self, listing_id, action):
+            self.change_listing(listing_id, action, self.request_data)
     
-    print("=" * 50)
-    print("  校园二手教材交易平台 - 后端服务")
-    print("=" * 50)
-    print()
-    print("正在初始化数据库...")
-    init_database()
-    print("✅ 数据库初始化完成!")
-    print()
-    print("正在启动服务器...")
-    print("访问地址: http://localhost:5000")
-    print("按 Ctrl+C 停止服务")
-    print()
-    print("=" * 50)
+    # 密码哈希用到了进程池，Windows 上子进程会重新导入本文件，启动逻辑必须放在 main 判断里
+    if __name__ == '__main__':
+        print("=" * 50)
+        print("  校园二手教材交易平台 - 后端服务")
+        print("=" * 50)
+        print()
+        print("正在初始化数据库...")
+        init_database()
+        print("✅ 数据库初始化完成!")
+        print()
+        print("正在启动服务器...")
+        print("访问地址: http://localhost:5000")
+        print(f"工作线程数: {DEFAULT_MAX_WORKERS} (可通过 TEXTBOOK_MAX_WORKERS 调整)")
+        print("按 Ctrl+C 停止服务")
+        print()
+        print("=" * 50)
     
-    with HTTPServer(('', 5000), Handler) as server:
-        print("✅ 服务器启动成功!")
-        server.serve_forever()
+        sweeper = auth.SessionSweeper(session_cache)
+        sweeper.start()
+        compactor.start()
+        writer.start()
+        request_log.start()
+        try:
+            with PooledHTTPServer(('', 5000), Handler, max_workers=DEFAULT_MAX_WORKERS,
+                                  idle_timeout=KEEPALIVE_TIMEOUT) as server:
+                print("✅ 服务器启动成功!")
+                server.serve_forever()
+        finally:
+            sweeper.stop()
+            sweeper.join(timeout=5)
+            compactor.stop()
+            compactor.join(timeout=5)
+            isbn_lookup.shutdown()
+            qr_cache.shutdown()
+            writer.stop()
+            request_log.stop()
+            password_hasher.shutdown()
+            db.close_all()
 
 except KeyboardInterrupt:
     print("\n\n服务器已停止")
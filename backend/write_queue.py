@@ -0,0 +1,125 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import db
+
+# 第一个写操作到达后最多再等这么久，把这段时间内的写操作合并成一个事务
+GROUP_COMMIT_WINDOW = float(os.environ.get('TEXTBOOK_GROUP_COMMIT_WINDOW_MS', '2')) / 1000
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('TEXTBOOK_GROUP_COMMIT_MAX_BATCH', '256'))
+MAX_QUEUED_WRITES = 10000
+WRITE_TIMEOUT = 10.0
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+class WriteQueue(threading.Thread):
+    # 单独的写线程持有一条写连接。并发的写请求排队进来，一批一个事务、一次 fsync；
+    # 每条语句包在 SAVEPOINT 里，某一条违反约束只回滚它自己，不影响同批的其他请求
+    def __init__(self, path=None, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH):
+        super().__init__(name='group-commit-writer', daemon=True)
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=MAX_QUEUED_WRITES)
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, sql, params):
+        future = Future()
+        try:
+            self._queue.put_nowait((sql, params, future))
+        except queue.Full:
+            raise WriteQueueFull()
+        return future
+
+    def execute(self, sql, params, timeout=WRITE_TIMEOUT):
+        # 返回 lastrowid；约束错误等 sqlite3 异常原样抛给调用方
+        return self._wait(sql, params, timeout)[0]
+
+    def update(self, sql, params, timeout=WRITE_TIMEOUT):
+        # 返回 rowcount，给 UPDATE / DELETE 判断条件是否命中
+        return self._wait(sql, params, timeout)[1]
+
+    def _wait(self, sql, params, timeout):
+        future = self.submit(sql, params)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # 还在排队的写操作取消掉，客户端收到 503 后重试不会写出重复数据；
+            # 写线程已经开始执行的取消不了，等它提交完按实际结果返回
+            if future.cancel():
+                raise WriteQueueFull()
+            return future.result()
+
+    def stop(self):
+        self._queue.put(None)
+        self.join(timeout=WRITE_TIMEOUT)
+
+    def run(self):
+        conn = db.connect(self.path)
+        # 事务完全由这里手动控制
+        conn.isolation_level = None
+        try:
+            while True:
+                op = self._queue.get()
+                if op is None:
+                    break
+                batch = [op]
+                stopping = False
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        op = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if op is None:
+                        stopping = True
+                        break
+                    batch.append(op)
+                self._commit(conn, batch)
+                if stopping:
+                    break
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for sql, params, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT write_op')
+                try:
+                    cursor = conn.execute(sql, params)
+                except (sqlite3.Error, OverflowError, ValueError) as e:
+                    # 参数绑定失败（比如整数超出范围）也只算这一条失败，不连累同批的其他请求
+                    conn.execute('ROLLBACK TO write_op')
+                    conn.execute('RELEASE write_op')
+                    results.append((future, None, e))
+                else:
+                    conn.execute('RELEASE write_op')
+                    results.append((future, (cursor.lastrowid, cursor.rowcount), None))
+            conn.execute('COMMIT')
+        except Exception as e:
+            # BEGIN 或 COMMIT 本身失败时整批都没有写入
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += len(results)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
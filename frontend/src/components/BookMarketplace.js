@@ -6,6 +6,9 @@ export default {
     setup() {
         const listings = ref([]);
         const loading = ref(false);
+        // 列表接口按页返回，还有下一页时响应头带 X-Next-Cursor
+        const nextCursor = ref(null);
+        const loadingMore = ref(false);
         const API_BASE = 'http://localhost:5000/api';
 
         const appointmentForm = reactive({
@@ -27,6 +30,7 @@ export default {
                 
                 if (Array.isArray(response.data)) {
                     listings.value = response.data;
+                    nextCursor.value = response.headers['x-next-cursor'] || null;
                     if (response.data.length === 0) {
                         ElMessage.info('暂无二手教材，快去发布第一本吧！');
                     } else {
@@ -50,6 +54,24 @@ export default {
             }
         };
 
+        const loadMore = async () => {
+            if (!nextCursor.value) return;
+            loadingMore.value = true;
+            try {
+                const response = await axios.get(`${API_BASE}/listings`, {
+                    params: { cursor: nextCursor.value },
+                    timeout: 10000
+                });
+                listings.value = listings.value.concat(response.data);
+                nextCursor.value = response.headers['x-next-cursor'] || null;
+            } catch (error) {
+                console.error('加载更多二手书失败:', error);
+                ElMessage.error('加载更多失败，请重试');
+            } finally {
+                loadingMore.value = false;
+            }
+        };
+
         const makeAppointment = async (listing) => {
             try {
                 const { value: formData } = await ElMessageBox.prompt(
@@ -129,6 +151,9 @@ export default {
         return {
             listings,
             loading,
+            nextCursor,
+            loadingMore,
+            loadMore,
             makeAppointment,
             contactSeller,
             addToFavorites,
@@ -142,7 +167,7 @@ export default {
         <div class="marketplace-container">
             <div class="marketplace-header">
                 <div class="header-info">
-                    <p>🛒 发现 {{ listings.length }} 本二手教材，支持在线预约验书</p>
+                    <p>🛒 {{ nextCursor ? '已加载' : '发现' }} {{ listings.length }} 本二手教材，支持在线预约验书</p>
                 </div>
                 <el-button @click="loadListings" :loading="loading" size="default">
                     🔄 刷新列表
@@ -225,6 +250,13 @@ export default {
                 </div>
             </div>
 
+            <!-- 还有下一页时显示 -->
+            <div v-if="nextCursor" class="load-more">
+                <el-button @click="loadMore" :loading="loadingMore" size="default">
+                    加载更多
+                </el-button>
+            </div>
+
             <!-- 空状态 -->
             <div v-if="listings.length === 0 && !loading" class="empty-state">
                 <div class="empty-content">
@@ -387,6 +419,11 @@ export default {
             font-size: 13px;
         }
         
+        .load-more {
+            text-align: center;
+            margin: 20px 0;
+        }
+
         .empty-state {
             text-align: center;
             padding: 80px 20px;
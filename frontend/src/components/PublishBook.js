@@ -62,9 +62,9 @@ export default {
                     condition: form.condition,
                     description: form.description,
                     contact_method: form.contact_method,
-                    contact_info: form.contact_info,
-                    seller_name: '当前用户', 
-                    seller_id: form.seller_id
+                    contact_info: form.contact_info
+                }, {
+                    headers: { Authorization: `Bearer ${localStorage.getItem('token') || ''}` }
                 });
                 
                 if (response.data.success) {
@@ -82,7 +82,11 @@ export default {
                 }
             } catch (error) {
                 console.error('发布失败:', error);
-                ElMessage.error('发布失败，请检查网络连接');
+                if (error.response && error.response.status === 401) {
+                    ElMessage.error('请先登录后再发布');
+                } else {
+                    ElMessage.error('发布失败，请检查网络连接');
+                }
             } finally {
                 loading.value = false;
             }
@@ -42,7 +42,10 @@ export default {
                 const response = await axios.post(`${API_BASE}/generate_qr`, {
                     text: isbnInput.value.trim()
                 });
-                qrCodeUrl.value = response.data.qr_code;
+                // 优先用可长期缓存的图片地址；只返回 data URL 的后端照旧处理
+                qrCodeUrl.value = response.data.url
+                    ? API_BASE.replace(/\/api$/, '') + response.data.url
+                    : response.data.qr_code;
                 ElMessage.success('📱 二维码生成成功！');
             } catch (error) {
                 console.error('二维码生成失败:', error);
@@ -57,9 +60,9 @@ export default {
         };
 
         const sampleISBNs = [
-            '9787111234567',
-            '9787302123456',
-            '9787508123456',
+            '9787111234562',
+            '9787302123453',
+            '9787508123455',
             '9787040123456'
         ];
 